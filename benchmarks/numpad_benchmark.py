@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""Benchmarks for the numpad dispatch and transport paths
+
+Runs without a printer attached:
+- component: drives NumpadMacros through stand-ins for Moonraker and Klippy
+  whose query_objects/run_gcode latency is configurable
+- listener: drives numpad_event_service.on_key_event with synthetic key
+  streams against a local stub of Moonraker's HTTP endpoint
+
+Usage:
+    python3 benchmarks/numpad_benchmark.py [component|listener|all] [options]
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "components"))
+sys.path.insert(0, os.path.join(REPO_DIR, "extras"))
+
+# Synthetic key streams: (key, scan code, keyboard library name)
+KNOB_UP = ("key_up", 115, "volume up")
+KNOB_DOWN = ("key_down", 114, "volume down")
+COMMAND_KEY = ("key_1", 79, "1")
+ENTER_KEY = ("key_enter", 96, "enter")
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99 of a list of millisecond samples"""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(samples)
+    def pick(pct: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(pct / 100. * len(ordered)))], 3)
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99)}
+
+
+def build_stream(scenario: str, count: int) -> List[Tuple[str, int, str]]:
+    """Key sequence for a scenario"""
+    if scenario == "knob_spin":
+        return [KNOB_UP] * count
+    if scenario == "knob_wobble":
+        return [KNOB_UP if (idx // 5) % 2 == 0 else KNOB_DOWN for idx in range(count)]
+    if scenario == "confirm_storm":
+        return [COMMAND_KEY if idx % 2 == 0 else ENTER_KEY for idx in range(count)]
+    if scenario == "mixed":
+        pattern = [KNOB_UP, KNOB_UP, KNOB_UP, COMMAND_KEY, KNOB_DOWN, ENTER_KEY]
+        return [pattern[idx % len(pattern)] for idx in range(count)]
+    raise ValueError(f"Unknown scenario '{scenario}'")
+
+
+SCENARIOS = ("knob_spin", "knob_wobble", "confirm_storm", "mixed")
+
+
+# Stand-ins for Moonraker and Klippy
+
+class FakeServerError(Exception):
+    def __init__(self, message: str, status_code: int = 400) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeTimer:
+    """Minimal version of Moonraker's FlexTimer"""
+    def __init__(self, event_loop: "FakeEventLoop", callback: Callable) -> None:
+        self.event_loop = event_loop
+        self.callback = callback
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+    def start(self, delay: float = 0.) -> None:
+        self.handle = self.event_loop.aioloop.call_later(delay, self._run)
+
+    def stop(self) -> None:
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    def _run(self) -> None:
+        async def run_callback() -> None:
+            next_time = self.callback(self.event_loop.get_loop_time())
+            if asyncio.iscoroutine(next_time):
+                next_time = await next_time
+            if next_time is not None and self.handle is not None:
+                self.start(max(0., next_time - self.event_loop.get_loop_time()))
+        self.event_loop.aioloop.create_task(run_callback())
+
+
+class FakeEventLoop:
+    """The parts of Moonraker's EventLoop used by the component"""
+    def __init__(self) -> None:
+        self.aioloop = asyncio.get_event_loop()
+        self.create_task = self.aioloop.create_task
+        self.create_future = self.aioloop.create_future
+        self.get_loop_time = self.aioloop.time
+        self.add_reader = self.aioloop.add_reader
+        self.remove_reader = self.aioloop.remove_reader
+
+    def register_callback(self, callback: Callable, *args: Any) -> None:
+        self.delay_callback(0., callback, *args)
+
+    def delay_callback(self, delay: float, callback: Callable, *args: Any) -> asyncio.TimerHandle:
+        def run() -> None:
+            result = callback(*args)
+            if asyncio.iscoroutine(result):
+                self.aioloop.create_task(result)
+        return self.aioloop.call_later(delay, run)
+
+    def register_timer(self, callback: Callable) -> FakeTimer:
+        return FakeTimer(self, callback)
+
+
+class FakeKlippyAPI:
+    """klippy_apis stand-in with configurable query and G-code latency"""
+    def __init__(self, status: Dict[str, Dict[str, Any]],
+                 query_latency: float, gcode_latency: float) -> None:
+        self.status = status
+        self.query_latency = query_latency
+        self.gcode_latency = gcode_latency
+        self.query_calls = 0
+        self.gcode_calls = 0
+        self.gcode_lines = 0
+        self.gcode_lock = asyncio.Lock()
+
+    async def query_objects(self, objects: Dict[str, Any], default: Any = None) -> Dict[str, Any]:
+        self.query_calls += 1
+        await asyncio.sleep(self.query_latency)
+        return {name: dict(self.status.get(name, {})) for name in objects}
+
+    async def subscribe_objects(self, objects: Dict[str, Any], callback: Any = None,
+                                default: Any = None) -> Dict[str, Any]:
+        return await self.query_objects(objects)
+
+    async def get_object_list(self, default: Any = None) -> List[str]:
+        return list(self.status)
+
+    async def run_gcode(self, script: str, default: Any = None) -> str:
+        # Klippy runs scripts one at a time behind its G-code mutex
+        async with self.gcode_lock:
+            self.gcode_calls += 1
+            self.gcode_lines += script.count("\n") + 1
+            await asyncio.sleep(self.gcode_latency)
+        return "ok"
+
+
+class FakeServer:
+    error = FakeServerError
+
+    def __init__(self, kapis: FakeKlippyAPI) -> None:
+        self.event_loop = FakeEventLoop()
+        self.kapis = kapis
+        self.endpoints: Dict[str, Callable] = {}
+
+    def get_event_loop(self) -> FakeEventLoop:
+        return self.event_loop
+
+    def register_endpoint(self, uri: str, request_types: List[str],
+                          callback: Callable, **kwargs: Any) -> None:
+        self.endpoints[uri] = callback
+
+    def register_notification(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    def register_event_handler(self, *args: Any) -> None:
+        pass
+
+    def send_event(self, *args: Any) -> "asyncio.Future[None]":
+        future = self.event_loop.create_future()
+        future.set_result(None)
+        return future
+
+    def lookup_component(self, name: str, default: Any = None) -> Any:
+        if name == "klippy_apis":
+            return self.kapis
+        return default
+
+
+class FakeConfig:
+    """ConfigHelper stand-in returning defaults unless overridden"""
+    error = ValueError
+
+    def __init__(self, server: FakeServer, options: Dict[str, Any]) -> None:
+        self.server = server
+        self.options = options
+
+    def get_server(self) -> FakeServer:
+        return self.server
+
+    def get_name(self) -> str:
+        return "numpad_macros"
+
+    def has_option(self, option: str) -> bool:
+        return option in self.options
+
+    def get(self, option: str, default: Any = None) -> Any:
+        return self.options.get(option, default)
+
+    def getboolean(self, option: str, default: Any = None) -> Any:
+        return self.options.get(option, default)
+
+    def getint(self, option: str, default: Any = None, **kwargs: Any) -> Any:
+        return self.options.get(option, default)
+
+    def getfloat(self, option: str, default: Any = None, **kwargs: Any) -> Any:
+        return self.options.get(option, default)
+
+    def getdict(self, option: str, default: Any = None) -> Any:
+        return self.options.get(option, default)
+
+    def getlist(self, option: str, default: Any = None, **kwargs: Any) -> Any:
+        return self.options.get(option, default)
+
+
+class FakeWebRequest:
+    def __init__(self, args: Dict[str, Any]) -> None:
+        self.args = args
+
+    def get_args(self) -> Dict[str, Any]:
+        return self.args
+
+    def get_str(self, key: str, default: Any = None) -> Any:
+        return self.args.get(key, default)
+
+
+# Component benchmark
+
+PRINTER_MODES = {
+    "standby": {"print_stats": {"state": "standby"}, "probe": False, "z": 10.},
+    "first_layer": {"print_stats": {"state": "printing"}, "probe": False, "z": 0.2},
+    "printing": {"print_stats": {"state": "printing"}, "probe": False, "z": 20.},
+    "probing": {"print_stats": {"state": "standby"}, "probe": True, "z": 2.},
+}
+
+
+async def run_component_scenario(scenario: str, mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    import numpad_macros
+
+    printer = PRINTER_MODES[mode]
+    status = {
+        "print_stats": dict(printer["print_stats"]),
+        "gcode_macro CHECK_PROBE_STATUS": {"monitor_active": printer["probe"]},
+        "toolhead": {"position": [0., 0., printer["z"], 0.]},
+        "gcode_move": {"speed_factor": 1.},
+    }
+    kapis = FakeKlippyAPI(status, args.query_latency / 1000., args.gcode_latency / 1000.)
+    server = FakeServer(kapis)
+    options: Dict[str, Any] = {"knob_coalesce_window": args.coalesce_window}
+    component = numpad_macros.NumpadMacros(FakeConfig(server, options))
+    await component.component_init()
+    await component._subscribe_klippy_objects()
+    subscribe_queries = kapis.query_calls
+
+    handler = server.endpoints["/server/numpad/event"]
+    latencies: List[float] = []
+    # Handler results by status: executed, coalesced, merged, dropped, superseded...
+    statuses: Dict[str, int] = collections.Counter()
+
+    async def send(key: str, scan_code: int) -> None:
+        start = time.monotonic()
+        try:
+            result = await handler(FakeWebRequest({
+                "key": key, "scan_code": scan_code, "event_type": "down",
+                "time": time.time(), "sent_time": time.time()
+            }))
+            statuses[result.get("status", "unknown")] += 1
+        except Exception:
+            statuses["error"] += 1
+            raise
+        finally:
+            latencies.append((time.monotonic() - start) * 1000.)
+
+    stream = build_stream(scenario, args.events)
+    start = time.monotonic()
+    tasks = []
+    for key, scan_code, _ in stream:
+        tasks.append(asyncio.ensure_future(send(key, scan_code)))
+        await asyncio.sleep(args.interval / 1000.)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # Let coalesced knob adjustments flush
+    await asyncio.sleep(args.coalesce_window + args.gcode_latency / 1000. * 4 + .05)
+    elapsed = time.monotonic() - start
+    backlog = component._get_knob_backlog()
+    await component.close()
+
+    return {
+        "scenario": scenario,
+        "mode": mode,
+        "events": len(stream),
+        "events_per_sec": round(len(stream) / elapsed, 1),
+        "klippy_queries": kapis.query_calls - subscribe_queries,
+        "run_gcode_calls": kapis.gcode_calls,
+        "gcode_lines": kapis.gcode_lines,
+        "merged_steps": backlog["merged_steps"],
+        "dropped_steps": backlog["dropped_steps"],
+        "statuses": dict(statuses),
+        "latency_ms": percentiles(latencies),
+    }
+
+
+def bench_component(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results = []
+    for scenario in args.scenarios:
+        for mode in args.modes:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                results.append(loop.run_until_complete(
+                    run_component_scenario(scenario, mode, args)))
+            finally:
+                loop.close()
+    return results
+
+
+# Listener benchmark
+
+class StubMoonraker(BaseHTTPRequestHandler):
+    """Local stand-in for Moonraker's /server/numpad/event endpoint"""
+    latency = 0.
+    received: List[Tuple[float, Dict[str, Any]]] = []
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        event = json.loads(self.rfile.read(length) or b"{}")
+        self.received.append((time.time(), event))
+        time.sleep(self.latency)
+        body = json.dumps({"result": {"status": "executed"}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def bench_listener(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    import numpad_event_service as listener
+
+    StubMoonraker.latency = args.gcode_latency / 1000.
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubMoonraker)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    listener.TRANSPORT = "http"
+    listener.MOONRAKER_URL = f"http://127.0.0.1:{httpd.server_address[1]}"
+    listener.load_transport()
+    listener.build_targets()
+    target = listener.default_target
+    target.connect()
+    threading.Thread(target=listener.sender_worker, args=(target,), daemon=True).start()
+
+    results = []
+    for scenario in args.scenarios:
+        target.last_key_time.clear()
+        target.knob_detent_times.clear()
+        target.stats.clear()
+        StubMoonraker.received = []
+        dropped_before = target.send_queue.dropped
+        hook_times: List[float] = []
+
+        stream = build_stream(scenario, args.events)
+        start = time.monotonic()
+        for _, scan_code, name in stream:
+            hook_start = time.monotonic()
+            listener.on_key_event(SimpleNamespace(event_type="down", scan_code=scan_code, name=name))
+            hook_times.append((time.monotonic() - hook_start) * 1000.)
+            time.sleep(args.interval / 1000.)
+        # Wait for the sender to drain the queue
+        deadline = time.monotonic() + 5.
+        while target.send_queue.events and time.monotonic() < deadline:
+            time.sleep(.01)
+        time.sleep(StubMoonraker.latency + .05)
+        elapsed = time.monotonic() - start
+
+        delivery = [(received - event["time"]) * 1000. for received, event in StubMoonraker.received]
+        results.append({
+            "scenario": scenario,
+            "events": len(stream),
+            "events_per_sec": round(len(stream) / elapsed, 1),
+            "delivered": len(StubMoonraker.received),
+            "debounced": target.stats["debounced"],
+            "dropped": target.send_queue.dropped - dropped_before,
+            "expired": target.stats["expired"],
+            "failed": target.stats["failed"],
+            "hook_ms": percentiles(hook_times),
+            "delivery_ms": percentiles(delivery),
+        })
+
+    httpd.shutdown()
+    return results
+
+
+def print_results(title: str, results: List[Dict[str, Any]]) -> None:
+    print(f"\n== {title} ==")
+    for result in results:
+        print("  " + ", ".join(f"{name}={value}" for name, value in result.items()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("target", nargs="?", default="all", choices=("component", "listener", "all"))
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--modes", nargs="+", default=list(PRINTER_MODES), choices=list(PRINTER_MODES))
+    parser.add_argument("--events", type=int, default=60, help="key events per scenario")
+    parser.add_argument("--interval", type=float, default=20., help="ms between key events")
+    parser.add_argument("--query-latency", type=float, default=5., help="Klippy query latency in ms")
+    parser.add_argument("--gcode-latency", type=float, default=20., help="run_gcode/HTTP latency in ms")
+    parser.add_argument("--coalesce-window", type=float, default=.15, help="knob coalescing window in s")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    if args.target in ("component", "all"):
+        results["component"] = bench_component(args)
+    if args.target in ("listener", "all"):
+        results["listener"] = bench_listener(args)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for title, target_results in results.items():
+        print_results(title, target_results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,23 @@
 from __future__ import annotations
 import logging
 import time
-from typing import TYPE_CHECKING, Dict, Any, Optional, Set as SetType
+from typing import (
+    TYPE_CHECKING, Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Set as SetType
+)
 import re
-import subprocess
+import bisect
+import collections
+import contextvars
+import functools
+import itertools
 
 import asyncio
 
+try:
+    import evdev
+except ImportError:
+    evdev = None
+
 
 def strip_comments(code):
     # This regex removes everything after a '#' unless it's inside a string
@@ -15,8 +26,249 @@ def strip_comments(code):
 if TYPE_CHECKING:
     from moonraker.common import WebRequest
     from moonraker.components.klippy_apis import KlippyAPI
+    from moonraker.components.shell_command import ShellCommandFactory
     from moonraker.confighelper import ConfigHelper
 
+# Klippy objects (and fields) the component keeps cached from its subscription
+SUBSCRIBED_OBJECTS: Dict[str, Optional[List[str]]] = {
+    'print_stats': ['state'],
+    'gcode_macro CHECK_PROBE_STATUS': ['monitor_active'],
+    'toolhead': ['position'],
+    'gcode_move': ['speed_factor'],
+}
+
+# Keys that can be bound in [numpad_macros], as named by the listener and
+# INPUT_KEY_MAPPING
+NUMPAD_KEYS = (
+    'key_1', 'key_2', 'key_3', 'key_4', 'key_5',
+    'key_6', 'key_7', 'key_8', 'key_9', 'key_0',
+    'key_dot', 'key_enter', 'key_up', 'key_down',
+    'key_1_alt', 'key_2_alt', 'key_3_alt', 'key_4_alt',
+    'key_5_alt', 'key_6_alt', 'key_7_alt', 'key_8_alt',
+    'key_9_alt', 'key_0_alt', 'key_dot_alt', 'key_enter_alt'
+)
+KNOB_KEYS = ('key_up', 'key_down')
+
+class KeyMap:
+    """Key bindings of a [numpad_macros] section compiled into a dispatch table
+
+    A KeyMap is built and validated in full before it is used, so replacing
+    the component's map swaps every binding at once.
+    """
+    def __init__(self, config: ConfigHelper) -> None:
+        self.no_confirm_keys = self._get_keys(
+            config, 'no_confirmation_keys', "key_up,key_down"
+        )
+        self.confirmation_keys = self._get_keys(
+            config, 'confirmation_keys', "key_enter,key_enter_alt"
+        )
+        both = self.no_confirm_keys & self.confirmation_keys
+        if both:
+            raise config.error(
+                f"Keys {sorted(both)} in section [{config.get_name()}] can not be "
+                "both confirmation and no confirmation keys"
+            )
+        # Cancel keys drop the pending command and stop running jobs
+        self.cancel_keys = self._get_keys(config, 'cancel_keys', "")
+        both = self.cancel_keys & (self.no_confirm_keys | self.confirmation_keys)
+        if both:
+            raise config.error(
+                f"Keys {sorted(both)} in section [{config.get_name()}] can not be "
+                "both cancel and confirmation or no confirmation keys"
+            )
+
+        self.command_mapping: Dict[str, str] = {}
+        self.query_mapping: Dict[str, str] = {}
+        for key in NUMPAD_KEYS:
+            # Check if the option exists in config
+            if config.has_option(key):
+                # Get the command value, strip whitespace
+                cmd = config.get(key)
+                if cmd:  # If command is not empty after stripping
+                    self.command_mapping[key] = cmd
+                    # Create QUERY version by adding prefix
+                    self.query_mapping[key] = f"_QUERY{cmd}" if cmd.startswith('_') else f"_QUERY_{cmd}"
+            else:
+                # Option not in config - add to both mappings
+                self.command_mapping[key] = f'_NO_ASSIGNED_MACRO KEY={key}'
+                self.query_mapping[key] = f'_NO_ASSIGNED_MACRO KEY={key}'
+
+        # Dispatch table, keys without an entry are ignored
+        self.key_classes: Dict[str, str] = {}
+        for key in NUMPAD_KEYS:
+            if key in self.confirmation_keys:
+                self.key_classes[key] = 'confirm'
+            elif key in self.cancel_keys:
+                self.key_classes[key] = 'cancel'
+            elif key in self.no_confirm_keys and key in KNOB_KEYS:
+                self.key_classes[key] = 'knob'
+            elif key not in self.command_mapping:
+                continue
+            elif key in self.no_confirm_keys:
+                self.key_classes[key] = 'direct'
+            else:
+                self.key_classes[key] = 'command'
+
+    @staticmethod
+    def _get_keys(config: ConfigHelper, option: str, default: str) -> SetType[str]:
+        keys = set(k.strip() for k in config.get(option, default).split(','))
+        keys.discard('')
+        unknown = keys.difference(NUMPAD_KEYS)
+        if unknown:
+            raise config.error(
+                f"Unknown keys {sorted(unknown)} in option '{option}' of "
+                f"section [{config.get_name()}]"
+            )
+        return keys
+
+# Feedback (sound) macros fired by the knob, skipped when the printer
+# config does not define them
+FEEDBACK_MACROS = (
+    '_FURTHER_KNOB_PROBE_MICRO_CALIBRATE', '_NEARER_KNOB_PROBE_MICRO_CALIBRATE',
+    '_FURTHER_KNOB_PROBE_CALIBRATE', '_NEARER_KNOB_PROBE_CALIBRATE',
+    '_FURTHER_KNOB_FIRST_LAYER', '_NEARER_KNOB_FIRST_LAYER',
+    '_INCREASE_KNOB_SPEED', '_DEACREASE_KNOB_SPEED',
+    '_INCREASE_KNOB_VOLUME', '_DEACREASE_KNOB_VOLUME'
+)
+
+# Linux key codes of the numpad, used when reading input devices directly.
+# Kept in sync with SCAN_CODE_MAPPING in extras/numpad_event_service.py
+INPUT_KEY_MAPPING: Dict[int, str] = {
+    # Numpad specific keys
+    79: "key_1", 80: "key_2", 81: "key_3", 75: "key_4", 76: "key_5",
+    77: "key_6", 71: "key_7", 72: "key_8", 73: "key_9", 82: "key_0",
+    83: "key_dot", 96: "key_enter", 114: "key_down", 115: "key_up",
+
+    # Numpad alternative keys
+    30: "key_1_alt", 48: "key_2_alt", 46: "key_3_alt", 32: "key_4_alt",
+    18: "key_5_alt", 33: "key_6_alt", 36: "key_7_alt", 38: "key_8_alt",
+    50: "key_9_alt", 37: "key_0_alt",
+
+    # Regular number keys (for alt mode)
+    2: "key_1_alt", 3: "key_2_alt", 4: "key_3_alt", 5: "key_4_alt",
+    6: "key_5_alt", 7: "key_6_alt", 8: "key_7_alt", 9: "key_8_alt",
+    10: "key_9_alt", 11: "key_0_alt", 28: "key_enter_alt", 41: "key_dot_alt",
+}
+
+# Knob acceleration when reading input devices directly, the rotation
+# velocity (detents per second over the last KNOB_VELOCITY_WINDOW seconds)
+# picks the step multiplier. Kept in sync with the listener's defaults
+KNOB_VELOCITY_WINDOW = 0.5
+KNOB_ACCELERATION = (  # (minimum detents per second, step multiplier)
+    (15, 8),
+    (10, 4),
+    (5, 2),
+    (0, 1)
+)
+
+# Upper bounds (ms) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram, percentiles are bucket upper bounds"""
+    def __init__(self) -> None:
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.
+        self.max_ms = 0.
+
+    def observe(self, ms: float) -> None:
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = pct / 100. * self.count
+        seen = 0
+        for idx, bucket_count in enumerate(self.bucket_counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                if idx < len(LATENCY_BUCKETS_MS):
+                    return round(min(LATENCY_BUCKETS_MS[idx], self.max_ms), 3)
+                break
+        return round(self.max_ms, 3)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'sum_ms': round(self.sum_ms, 3),
+            'max_ms': round(self.max_ms, 3),
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+        }
+
+class EventTrace:
+    """Per-stage timing (ms) of a single key event through the component"""
+    def __init__(
+            self, key: str, key_class: str, mode: str, start: Optional[float] = None
+    ) -> None:
+        self.key = key
+        self.key_class = key_class
+        self.mode = mode
+        self.start = time.monotonic() if start is None else start
+        self.stages: Dict[str, float] = {}
+        self.gcode: List[str] = []
+
+    def add(self, stage: str, ms: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.) + ms
+
+# Trace of the event being handled, Klippy calls add their timing to it
+_current_trace: contextvars.ContextVar[Optional[EventTrace]] = \
+    contextvars.ContextVar('numpad_trace', default=None)
+
+# Queue priority per key class, lower runs first. Confirm and command keys
+# share a priority so a confirmation never overtakes the key it confirms
+EVENT_PRIORITY = {'confirm': 0, 'cancel': 0, 'command': 0, 'direct': 0, 'knob': 1}
+
+class QueuedEvent:
+    """An event waiting for the component's single event consumer"""
+    def __init__(
+            self,
+            trace: EventTrace,
+            handler: Callable[[], Awaitable[Any]],
+            future: Optional[asyncio.Future]
+    ) -> None:
+        self.trace = trace
+        self.key_class = trace.key_class
+        self.handler = handler
+        self.future = future
+        self.task: Optional[asyncio.Task] = None
+
+# Seconds after the last detent that merged knob steps are still applied
+KNOB_PENDING_TTL = 1.0
+
+# Number of finished command jobs kept in the status
+JOB_HISTORY_SIZE = 10
+
+class CommandJob:
+    """A confirmed command running in the background"""
+    def __init__(self, job_id: int, key: str, command: str) -> None:
+        self.job_id = job_id
+        self.key = key
+        self.command = command
+        self.state = 'running'
+        self.error: Optional[str] = None
+        self.started = time.time()
+        self.duration: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # History record of the confirmation, updated when the job finishes
+        self.record: Optional[Dict[str, Any]] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'key': self.key,
+            'command': self.command,
+            'state': self.state,
+            'error': self.error,
+            'started': self.started,
+            'duration': self.duration
+        }
+
 class NumpadMacros:
     def __init__(self, config: ConfigHelper) -> None:
         self.server = config.get_server()
@@ -69,26 +321,15 @@ class NumpadMacros:
             'fine_tune_from', 0.05, above=0., below=1.
         )
 
-        # Define default no-confirm and confirmation keys
-        default_no_confirm = "key_up,key_down"
-        default_confirm = "key_enter,key_enter_alt"
-
-        # Get configuration for no-confirm and confirmation keys
-        no_confirm_str = config.get('no_confirmation_keys', default_no_confirm)
-        confirm_str = config.get('confirmation_keys', default_confirm)
+        # Key bindings, replaced as a whole by /server/numpad/reload
+        self.config = config
+        self.keymap = KeyMap(config)
+        self._log_keymap()
 
-        # Convert comma-separated strings to sets
-        self.no_confirm_keys: SetType[str] = set(k.strip() for k in no_confirm_str.split(','))
-        self.confirmation_keys: SetType[str] = set(k.strip() for k in confirm_str.split(','))
-
-        if self.debug_log:
-            self.logger.debug(f"No confirmation required for keys: {self.no_confirm_keys}")
-            self.logger.debug(f"Confirmation keys: {self.confirmation_keys}")
-
-        # Get command mappings from config
-        self.command_mapping: Dict[str,str] = {}
-        self.initial_query_command_mapping: Dict[str, str] = {}
-        self._load_command_mapping(config)
+        # Names of the gcode_macro objects defined in Klippy, indexed on
+        # klippy_ready. None until known, nothing is skipped then.
+        self._available_macros: Optional[SetType[str]] = None
+        self._missing_macros: List[str] = []
 
         # State tracking
         self.pending_key: Optional[str] = None
@@ -101,6 +342,104 @@ class NumpadMacros:
         self._pending_z_offset_save = False
         self._last_z_adjust_time = 0.0
         self._accumulated_z_adjust = 0.0
+        self._z_offset_save_task: Optional[asyncio.Task] = None
+
+        # Send each key action as one multi-line script, disable to run every
+        # line as a separate request for per-line error reporting
+        self.batch_gcode = config.getboolean('batch_gcode', True)
+
+        # Knob coalescing window (seconds), 0 sends every detent on its own
+        self.knob_coalesce_window = config.getfloat(
+            'knob_coalesce_window', 0.15, minval=0.
+        )
+        # Upper limit for the step multiplier the listener sends with fast turns
+        self.max_knob_multiplier = config.getint('max_knob_multiplier', 10, minval=1)
+        self._knob_pending_steps = 0
+        self._knob_window_start = 0.
+        self._knob_flush_handle: Optional[asyncio.TimerHandle] = None
+
+        # At most one knob adjustment is queued or running in Klippy, detents
+        # arriving meanwhile are merged into the next one, up to this many
+        # steps. Further detents are dropped, as are all of them while Klippy
+        # runs other G-code, which would delay them past the operator's turn.
+        self.knob_backlog_limit = config.getint('knob_backlog_limit', 10, minval=1)
+        self._knob_in_flight = False
+        self._knob_last_detent = 0.
+        self._knob_merged_steps = 0
+        self._knob_dropped_steps = 0
+        # G-code sent to Klippy and not yet done, knob adjustments excluded
+        self._gcode_outstanding = 0
+
+        # Local copy of the subscribed Klippy objects, updated from the
+        # status update stream so key handling never has to query Klippy
+        self._klippy_status: Dict[str, Dict[str, Any]] = {}
+        self._is_subscribed = False
+
+        # Input mode: "service" receives events from numpad_event_service,
+        # "direct" reads the input devices on Moonraker's event loop
+        self.input_mode = config.get('input_mode', 'service')
+        if self.input_mode not in ('service', 'direct'):
+            raise config.error(
+                f"{self.name}: input_mode must be 'service' or 'direct', got '{self.input_mode}'"
+            )
+        self.input_devices = config.getlist('input_devices', [])
+        self.grab_input_devices = config.getboolean('grab_input_devices', False)
+        self.input_debounce = config.getfloat('input_debounce', 0.2, minval=0.)
+        self.knob_input_debounce = config.getfloat('knob_input_debounce', 0.1, minval=0.)
+        if self.input_mode == 'direct':
+            if evdev is None:
+                raise config.error(f"{self.name}: input_mode 'direct' requires the evdev package")
+            if not self.input_devices:
+                raise config.error(f"{self.name}: input_mode 'direct' requires input_devices")
+        self._open_devices: Dict[str, Any] = {}
+        self._last_input_time: Dict[str, float] = {}
+        self._knob_detent_times: Dict[str, Deque[float]] = collections.defaultdict(collections.deque)
+        self._listener_ignored_pid: Optional[int] = None
+        self._input_timer = self.event_loop.register_timer(self._check_input_devices)
+
+        # Listener supervision, the service is only restarted when its
+        # heartbeat goes missing
+        self.listener_service = config.get('listener_service', 'numpad_event_service')
+        self.listener_heartbeat_timeout = config.getfloat(
+            'listener_heartbeat_timeout', 15., above=0.
+        )
+        # Startup counts as a heartbeat so the listener gets a grace period
+        self._listener_heartbeat = time.monotonic()
+        self._listener_info: Dict[str, Any] = {}
+        self._listener_restarts = 0
+        self._listener_restart_task: Optional[asyncio.Task] = None
+        # Set by the listener's registration once its input hook is live
+        self._listener_ready_pid: Optional[int] = None
+        self._listener_startup: Dict[str, float] = {}
+        self._listener_restart_requested: Optional[float] = None
+        self._supervisor_timer = self.event_loop.register_timer(self._check_listener)
+
+        # All events are handled one at a time by a single consumer
+        self._event_queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._event_seq = itertools.count()
+        self._latest_command_seq = -1
+        self._active_event: Optional[QueuedEvent] = None
+        self._event_consumer: Optional[asyncio.Task] = None
+
+        # Confirmed commands run as background jobs so keys stay responsive
+        self._job_ids = itertools.count(1)
+        # Running jobs stay until they finish, only finished ones are trimmed
+        self._running_jobs: Dict[int, CommandJob] = {}
+        self._jobs: collections.deque = collections.deque(maxlen=JOB_HISTORY_SIZE)
+        # Key G-code sent while a job holds Klippy, see _run_klippy_script
+        self._background_scripts: SetType[asyncio.Task] = set()
+
+        # Versioned status, notifications only carry changed fields
+        self._status_version = 0
+        self._static_version = 1
+        self._notified_status: Dict[str, Any] = {}
+
+        # Latency histograms keyed by (stage, key class, printer mode)
+        self._latency: Dict[Tuple[str, str, str], LatencyHistogram] = {}
+
+        # Flight recorder, compact records of the most recent key events
+        history_size = config.getint('history_size', 100, minval=1)
+        self._history: collections.deque = collections.deque(maxlen=history_size)
 
         # Register endpoints
         self.server.register_endpoint(
@@ -109,6 +448,27 @@ class NumpadMacros:
         self.server.register_endpoint(
             "/server/numpad/status", ['GET'], self._handle_status_request
         )
+        self.server.register_endpoint(
+            "/server/numpad/metrics", ['GET'], self._handle_metrics_request
+        )
+        # Prometheus only accepts its own content type for the text format
+        self.server.register_endpoint(
+            "/server/numpad/metrics/prometheus", ['GET'],
+            self._handle_prometheus_request, wrap_result=False,
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+        self.server.register_endpoint(
+            "/server/numpad/heartbeat", ['POST'], self._handle_heartbeat
+        )
+        self.server.register_endpoint(
+            "/server/numpad/register", ['POST'], self._handle_register
+        )
+        self.server.register_endpoint(
+            "/server/numpad/reload", ['POST'], self._handle_reload_request
+        )
+        self.server.register_endpoint(
+            "/server/numpad/history", ['GET'], self._handle_history_request
+        )
 
         # Register notifications
         self.server.register_notification('numpad_macros:status_update')
@@ -122,44 +482,178 @@ class NumpadMacros:
         self.server.register_event_handler(
             "server:klippy_shutdown", self._handle_shutdown
         )
+        self.server.register_event_handler(
+            "server:klippy_disconnect", self._handle_disconnect
+        )
 
         if self.debug_log:
             self.logger.debug(f"{self.name}: Component Initialized")
 
-    def _load_command_mapping(self, config: ConfigHelper) -> None:
-        """Load command mappings from config"""
-        key_options = [
-            'key_1', 'key_2', 'key_3', 'key_4', 'key_5',
-            'key_6', 'key_7', 'key_8', 'key_9', 'key_0',
-            'key_dot', 'key_enter', 'key_up', 'key_down',
-            'key_1_alt', 'key_2_alt', 'key_3_alt', 'key_4_alt',
-            'key_5_alt', 'key_6_alt', 'key_7_alt', 'key_8_alt',
-            'key_9_alt', 'key_0_alt', 'key_dot_alt', 'key_enter_alt'
-        ]
+    def _log_keymap(self) -> None:
+        if not self.debug_log:
+            return
+        self.logger.debug(f"No confirmation required for keys: {self.keymap.no_confirm_keys}")
+        self.logger.debug(f"Confirmation keys: {self.keymap.confirmation_keys}")
+        self.logger.debug(f"Cancel keys: {self.keymap.cancel_keys}")
+        for key, cmd in self.keymap.command_mapping.items():
+            self.logger.debug(
+                f"Loaded mapping for {key} -> Command: {cmd}, "
+                f"Query: {self.keymap.query_mapping[key]}"
+            )
 
-        for key in key_options:
-            # Check if the option exists in config
-            if config.has_option(key):
-                # Get the command value, strip whitespace
-                cmd = config.get(key)
-                if cmd:  # If command is not empty after stripping
-                    self.command_mapping[key] = cmd
-                    # Create QUERY version by adding prefix
-                    self.initial_query_command_mapping[key] = f"_QUERY{cmd}" if cmd.startswith('_') else f"_QUERY_{cmd}"
+    async def _handle_reload_request(self, web_request: WebRequest) -> Dict[str, Any]:
+        """Re-read the key bindings of the [numpad_macros] section
 
-                    if self.debug_log:
-                        self.logger.debug(
-                            f"Loaded mapping for {key} -> Command: {self.command_mapping[key]}, "
-                            f"Query: {self.initial_query_command_mapping[key]}"
-                        )
-            else:
-                # Option not in config - add to both mappings
-                self.command_mapping[key] = f'_NO_ASSIGNED_MACRO KEY={key}'
-                self.initial_query_command_mapping[key] = f'_NO_ASSIGNED_MACRO KEY={key}'
+        Only the key bindings are reloaded, other options need a Moonraker
+        restart. An invalid section leaves the current bindings in place.
+        """
+        start = time.monotonic()
+        config_file = self.server.get_app_args()['config_file']
+        try:
+            keymap = await self.event_loop.run_in_thread(
+                self._read_keymap, config_file
+            )
+        except self.config.error as e:
+            raise self.server.error(f"Invalid [{self.name}] section: {e}", 400)
+
+        old_keymap = self.keymap
+        changed = sorted(
+            key for key in NUMPAD_KEYS
+            if old_keymap.key_classes.get(key) != keymap.key_classes.get(key)
+            or old_keymap.command_mapping.get(key) != keymap.command_mapping.get(key)
+        )
+        self.keymap = keymap
+        # A pending command whose binding changed is no longer what the
+        # user asked to confirm
+        if self.pending_key is not None and self.pending_key in changed:
+            self.pending_key = None
+            self.pending_command = None
+        self._missing_macros = self._find_missing_macros()
+        self._log_keymap()
+        self._notify_status_update(static_changed=True)
+        duration = (time.monotonic() - start) * 1000.
+        self.logger.info(f"Reloaded key bindings in {duration:.1f}ms, changed keys: {changed}")
+        return {'status': 'reloaded', 'changed_keys': changed, 'duration_ms': round(duration, 3)}
+
+    def _read_keymap(self, config_file: str) -> KeyMap:
+        supplemental = self.config.read_supplemental_config(config_file)
+        return KeyMap(supplemental.getsection(self.name))
+
+    async def component_init(self) -> None:
+        self._event_consumer = self.event_loop.create_task(self._process_event_queue())
+        if self.input_mode == 'service':
+            self._supervisor_timer.start(self.listener_heartbeat_timeout)
+        if self.input_mode == 'direct':
+            self._input_timer.start()
 
     async def _handle_numpad_event(self, web_request: WebRequest) -> Dict[str, Any]:
+        if self.input_mode == 'direct':
+            # The input devices are read here, events from a listener that
+            # still runs would handle every press twice
+            self._warn_listener_in_direct_mode(web_request.get_args())
+            return {'status': 'ignored', 'reason': "input_mode is direct"}
+        return await self._process_numpad_event(web_request.get_args())
+
+    async def _process_numpad_event(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Dispatch a key event, from the HTTP endpoint or a direct input device"""
+        received = time.time()
+        key: str = event.get('key', '')
+        trace = EventTrace(key, self._get_key_class(key), self._get_printer_mode())
+        # The listener stamps the hook time and the time it sent the event
+        if 'time' in event and 'sent_time' in event:
+            trace.add('hook_to_send', (event['sent_time'] - event['time']) * 1000.)
+            trace.add('transport', (received - event['sent_time']) * 1000.)
+        if trace.key_class == 'unbound':
+            # Never queued, so stray keys can't supersede a pending command
+            if self.debug_log:
+                self.logger.debug(f"Ignoring unbound key: {key}")
+            result = {'status': 'ignored'}
+            self._record_history(trace, result, None)
+            return result
+        if trace.key_class == 'knob':
+            self._knob_last_detent = time.monotonic()
+            if self._knob_in_flight or self._is_klippy_busy():
+                # Klippy still has a knob adjustment or other G-code to
+                # work through, an adjustment queued now would apply late
+                result = self._merge_knob_steps(key, self._get_knob_multiplier(event))
+                self._record_history(trace, result, None)
+                self._notify_status_update()
+                return result
+            self._knob_in_flight = True
+        future = self._enqueue_event(
+            trace, functools.partial(self._dispatch_numpad_event, event), wait=True
+        )
+        return await future
+
+    def _enqueue_event(
+            self,
+            trace: EventTrace,
+            handler: Callable[[], Awaitable[Any]],
+            wait: bool = False
+    ) -> Optional[asyncio.Future]:
+        """Queue an event for the consumer, returns a future for its result"""
+        seq = next(self._event_seq)
+        future = self.event_loop.create_future() if wait else None
+        if trace.key_class in ('command', 'cancel'):
+            # A new command key replaces any queued one and stops the
+            # query still running for the key it replaces, a cancel key
+            # drops both
+            self._latest_command_seq = seq
+            active = self._active_event
+            if active is not None and active.key_class == 'command' and active.task is not None:
+                if self.debug_log:
+                    self.logger.debug(f"Cancelling query for superseded key {active.trace.key}")
+                active.task.cancel()
+        self._event_queue.put_nowait(
+            (EVENT_PRIORITY[trace.key_class], seq, QueuedEvent(trace, handler, future))
+        )
+        return future
+
+    async def _process_event_queue(self) -> None:
+        """Single consumer, handles queued events one at a time"""
+        while True:
+            _, seq, item = await self._event_queue.get()
+            if item.key_class == 'command' and seq != self._latest_command_seq:
+                if self.debug_log:
+                    self.logger.debug(f"Skipping superseded key {item.trace.key}")
+                self._record_history(item.trace, {'status': 'superseded'}, None)
+                if item.future is not None and not item.future.done():
+                    item.future.set_result({'status': 'superseded'})
+                continue
+
+            item.task = self.event_loop.create_task(self._run_queued_event(item))
+            self._active_event = item
+            await asyncio.wait([item.task])
+            self._active_event = None
+
+            if item.task.cancelled():
+                result: Any = {'status': 'superseded'}
+                error: Optional[BaseException] = None
+            else:
+                error = item.task.exception()
+                result = None if error is not None else item.task.result()
+            self._record_history(item.trace, result, error)
+            if item.key_class == 'knob':
+                self._release_knob_slot()
+            if item.future is None or item.future.done():
+                continue
+            if error is not None:
+                item.future.set_exception(error)
+            else:
+                item.future.set_result(result)
+
+    async def _run_queued_event(self, item: QueuedEvent) -> Any:
+        trace = item.trace
+        token = _current_trace.set(trace)
+        try:
+            trace.add('queue', (time.monotonic() - trace.start) * 1000.)
+            return await item.handler()
+        finally:
+            _current_trace.reset(token)
+            self._record_trace(trace)
+
+    async def _dispatch_numpad_event(self, event: Dict[str, Any]) -> Dict[str, Any]:
         try:
-            event = web_request.get_args()
             key: str = event.get('key', '')
             event_type: str = event.get('event_type', '')
 
@@ -168,41 +662,44 @@ class NumpadMacros:
                 self.logger.debug(f"Current state - pending_key: {self.pending_key}, "
                                   f"pending_command: {self.pending_command}")
 
+            key_class = self.keymap.key_classes.get(key)
+            if key_class is None:
+                if self.debug_log:
+                    self.logger.debug(f"Ignoring unbound key: {key}")
+                return {'status': 'ignored'}
+
             # THE MOST 1ST ORDER IMPORTANT KEY
             # First, check if it's a confirmation key
-            if key in self.confirmation_keys:
+            if key_class == 'confirm':
                 if self.debug_log:
                     self.logger.debug("Processing confirmation key")
-                await self._handle_confirmation()
-                return {'status': 'confirmed'}
+                job_id = await self._handle_confirmation()
+                if job_id is None:
+                    return {'status': 'confirmed'}
+                return {'status': 'confirmed', 'job_id': job_id}
+
+            if key_class == 'cancel':
+                return await self._handle_cancel()
 
             # THESE COMMAND RUN DIRECTLY AND 2ND ORDER
             # Then check if it's a no-confirmation key
-            if key in self.no_confirm_keys:
+            if key_class in ('knob', 'direct'):
                 if self.debug_log:
                     self.logger.debug(f"Processing no-confirmation key: {key}")
 
                 # Handle adjustment keys specially
                 # Check if we are dealing with up and down, they are special 3RD ORDER
-                if key in ['key_up', 'key_down']:
-                    await self._handle_knob_adjustment(key)
+                if key_class == 'knob':
+                    return await self._handle_knob_event(key, self._get_knob_multiplier(event))
                 else:
                     # Now we can run the query command directly because
                     # we are dealing with real command as is no confirmation key.
                     # Execute command directly without query prefix
-                    command = self.command_mapping[key]
+                    command = self.keymap.command_mapping[key]
                     if self.debug_log:
                         self.logger.debug(f"Executing no-confirmation command: {command}")
 
-                    await self._execute_gcode(f'RESPOND MSG="Numpad macros: Executing {command}"')
-                    await self._execute_gcode(command)
-
-                    # Maintain status updates and notifications
-                    await self.server.send_event(
-                        "numpad_macros:command_executed",
-                        {'command': command}
-                    )
-                    self._notify_status_update()
+                    await self._run_klippy_script(self._execute_direct_command(command))
 
                 return {'status': 'executed'}
 
@@ -217,30 +714,69 @@ class NumpadMacros:
             self.logger.exception("Error processing numpad event")
             raise
 
+    async def _run_klippy_script(self, script: Awaitable[None], background: bool = False) -> None:
+        """Run a key's G-code, in the background while a job holds Klippy
+
+        Klippy runs one script at a time, so while a confirmed command runs
+        awaiting a key's query or RESPOND would hold the event consumer and
+        every key queued behind it until the job finishes.
+        """
+        if not background and not self._running_jobs:
+            await script
+            return
+        task = self.event_loop.create_task(self._run_background_script(script))
+        self._background_scripts.add(task)
+        task.add_done_callback(self._background_scripts.discard)
+
+    async def _run_background_script(self, script: Awaitable[None]) -> None:
+        try:
+            await script
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.logger.exception("Error running numpad G-code behind a job")
+
+    async def _execute_direct_command(self, command: str) -> None:
+        await self._execute_gcode_batch([
+            f'RESPOND MSG="Numpad macros: Executing {command}"',
+            command
+        ])
+
+        # Maintain status updates and notifications
+        await self.server.send_event(
+            "numpad_macros:command_executed",
+            {'command': command}
+        )
+        self._notify_status_update()
+
     async def _handle_command_key(self, key: str) -> None:
         """Handle regular command keys that require confirmation"""
         if self.debug_log:
             self.logger.debug(f"Processing command key: {key}")
 
+        script: List[str] = []
+
         # Store as pending command (replaces any existing pending command)
         if self.pending_key and self.pending_key != key:
-            await self._execute_gcode(
+            script.append(
                 f'RESPOND MSG="Numpad macros: Replacing pending command '
-                f'{self.command_mapping[self.pending_key]} with {self.command_mapping[key]}"'
+                f'{self.pending_command} with {self.keymap.command_mapping[key]}"'
             )
 
         # Store the pending command
         self.pending_key = key
-        self.pending_command = self.command_mapping[key]
+        self.pending_command = self.keymap.command_mapping[key]
 
         # Run the QUERY version for confirmation-required commands
-        query_cmd = self.initial_query_command_mapping[key]
-        await self._execute_gcode(f'RESPOND MSG="Numpad macros: Running query {query_cmd}"')
-        await self._execute_gcode(query_cmd)
+        query_cmd = self.keymap.query_mapping[key]
+        if self._macro_available(query_cmd):
+            script.append(f'RESPOND MSG="Numpad macros: Running query {query_cmd}"')
+            script.append(query_cmd)
 
-        await self._execute_gcode(
+        script.append(
             f'RESPOND MSG="Numpad macros: Command {self.pending_command} is ready. Press ENTER to execute"'
         )
+        await self._run_klippy_script(self._execute_gcode_batch(script))
 
         self._notify_status_update()
         await self.server.send_event(
@@ -248,8 +784,12 @@ class NumpadMacros:
             {'command': self.pending_command}
         )
 
-    async def _handle_confirmation(self) -> None:
-        """Handle confirmation key press"""
+    async def _handle_confirmation(self) -> Optional[int]:
+        """Handle confirmation key press
+
+        The confirmed command runs as a background job, the id of the job is
+        returned straight away.
+        """
         if self.debug_log:
             self.logger.debug(f"Handling confirmation with state - pending_key: {self.pending_key}, "
                             f"pending_command: {self.pending_command}")
@@ -257,51 +797,250 @@ class NumpadMacros:
         if not self.pending_key or not self.pending_command:
             if self.debug_log:
                 self.logger.debug("No pending command to confirm")
-            await self._execute_gcode('RESPOND MSG="Numpad macros: No command pending for confirmation"')
-            return
+            await self._run_klippy_script(self._execute_gcode(
+                'RESPOND MSG="Numpad macros: No command pending for confirmation"'
+            ))
+            return None
 
-        try:
-            # Store command locally before clearing state
-            cmd = self.pending_command
-            if self.debug_log:
-                self.logger.debug(f"Executing confirmed command: {cmd}")
+        job = CommandJob(next(self._job_ids), self.pending_key, self.pending_command)
+        self._running_jobs[job.job_id] = job
+        job.task = self.event_loop.create_task(self._run_command_job(job))
 
-            # Execute the command
-            await self._execute_gcode(f'RESPOND MSG="Numpad macros: Executing confirmed command {cmd}"')
+        # Clear pending command state
+        self.pending_key = None
+        self.pending_command = None
+        if self.debug_log:
+            self.logger.debug(f"Started job {job.job_id} for confirmed command: {job.command}")
+        self._notify_status_update()
+        return job.job_id
 
-            await self._execute_gcode(cmd)
+    async def _handle_cancel(self) -> Dict[str, Any]:
+        """Handle cancel key press
 
-            # Notify of execution
-            await self.server.send_event(
-                "numpad_macros:command_executed",
-                {'command': cmd}
-            )
+        Drops the pending command and cancels the running jobs. Moonraker
+        stops waiting for a cancelled job's G-code, a macro Klippy already
+        started still runs to its end.
+        """
+        cancelled_command = self.pending_command
+        self.pending_key = None
+        self.pending_command = None
+        tasks = [job.task for job in self._running_jobs.values() if job.task is not None]
+        job_ids = list(self._running_jobs)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+        if self.debug_log:
+            self.logger.debug(f"Cancelled pending command {cancelled_command} and jobs {job_ids}")
 
+        if cancelled_command is None and not job_ids:
+            message = "Nothing to cancel"
+        else:
+            cancelled = [cancelled_command] if cancelled_command else []
+            cancelled += [f"job {job_id}" for job_id in job_ids]
+            message = f"Cancelled {', '.join(cancelled)}"
+        # Klippy may still be running a cancelled job's macro
+        await self._run_klippy_script(
+            self._execute_gcode(f'RESPOND MSG="Numpad macros: {message}"'),
+            background=bool(job_ids)
+        )
+        self._notify_status_update()
+        return {'status': 'cancelled', 'jobs': job_ids}
+
+    async def _run_command_job(self, job: CommandJob) -> None:
+        """Run a confirmed command and record its outcome"""
+        # Not part of the key event that started the job
+        _current_trace.set(None)
+        start = time.monotonic()
+        try:
+            await self._execute_gcode_batch([
+                f'RESPOND MSG="Numpad macros: Executing confirmed command {job.command}"',
+                job.command
+            ])
+            job.state = 'succeeded'
+        except asyncio.CancelledError:
+            job.state = 'failed'
+            job.error = 'cancelled'
+            raise
         except Exception as e:
+            job.state = 'failed'
+            job.error = str(e)
             self.logger.exception(f"Error executing command: {str(e)}")
             await self._execute_gcode(f'RESPOND TYPE=error MSG="Numpad macros: Error executing command: {str(e)}"')
         finally:
-            # Clear pending command state
-            self.pending_key = None
-            self.pending_command = None
+            job.duration = round(time.monotonic() - start, 3)
+            job.task = None
+            del self._running_jobs[job.job_id]
+            self._jobs.append(job)
+            self._update_job_record(job)
+
+        # Notify of execution
+        await self.server.send_event(
+            "numpad_macros:command_executed",
+            {'command': job.command, 'job': job.as_dict()}
+        )
+        self._notify_status_update()
+
+    def _get_jobs(self) -> List[Dict[str, Any]]:
+        """Recent finished jobs followed by the running ones, oldest first"""
+        jobs = list(self._jobs) + list(self._running_jobs.values())
+        return [job.as_dict() for job in sorted(jobs, key=lambda job: job.job_id)]
+
+    def _get_knob_multiplier(self, event: Dict[str, Any]) -> int:
+        """Step multiplier sent by the listener for fast knob turns"""
+        try:
+            multiplier = int(event.get('multiplier', 1))
+        except (TypeError, ValueError):
+            return 1
+        return max(1, min(multiplier, self.max_knob_multiplier))
+
+    async def _handle_knob_event(self, key: str, multiplier: int = 1) -> Dict[str, Any]:
+        """Coalesce knob detents into net adjustments
+
+        The first detent is applied straight away for instant feedback. Any
+        further detents arriving within the coalescing window are summed and
+        sent as a single adjustment when the window closes.
+        """
+        if self.knob_coalesce_window <= 0.:
+            return await self._handle_knob_adjustment(key, multiplier)
+
+        if self._knob_flush_handle is None:
+            self._knob_window_start = time.monotonic()
+            self._knob_flush_handle = self.event_loop.delay_callback(
+                self.knob_coalesce_window, self._flush_knob_adjustment
+            )
+            return await self._handle_knob_adjustment(key, multiplier)
+
+        self._knob_pending_steps += multiplier if key == 'key_up' else -multiplier
+        if self.debug_log:
+            self.logger.debug(f"Coalesced knob detent, pending steps: {self._knob_pending_steps}")
+        return {'status': 'coalesced'}
+
+    def _flush_knob_adjustment(self) -> None:
+        """Queue the net adjustment collected during the coalescing window"""
+        if self._knob_pending_steps == 0:
+            # Knob went quiet (or detents cancelled out), close the window
+            self._knob_flush_handle = None
+            return
+
+        # Keep the window open while the knob is still turning
+        self._knob_flush_handle = self.event_loop.delay_callback(
+            self.knob_coalesce_window, self._flush_knob_adjustment
+        )
+        self._send_pending_knob_steps()
+        self._notify_status_update()
+
+    def _send_pending_knob_steps(self) -> None:
+        """Queue the pending knob steps as one adjustment
+
+        Nothing is queued while a knob adjustment is in flight, the steps
+        stay pending until it completes.
+        """
+        steps = self._knob_pending_steps
+        if steps == 0 or self._knob_in_flight:
+            return
+        self._knob_pending_steps = 0
+        if (self._is_klippy_busy()
+                or time.monotonic() - self._knob_last_detent > KNOB_PENDING_TTL):
+            # The operator stopped turning a while ago
+            self._knob_dropped_steps += abs(steps)
             if self.debug_log:
-                self.logger.debug("Cleared pending command state")
-            self._notify_status_update()
+                self.logger.debug(f"Dropping {abs(steps)} stale knob steps")
+            return
+        key = 'key_up' if steps > 0 else 'key_down'
+        # Time spent waiting in the coalescing window counts as queueing
+        trace = EventTrace(key, 'knob', self._get_printer_mode(), self._knob_window_start)
+        self._knob_window_start = time.monotonic()
+        self._knob_in_flight = True
+        self._enqueue_event(
+            trace, functools.partial(self._handle_knob_adjustment, key, abs(steps))
+        )
+
+    def _merge_knob_steps(self, key: str, multiplier: int) -> Dict[str, Any]:
+        """Merge a detent into the pending adjustment while one is in flight,
+        or drop it while Klippy is busy with other G-code"""
+        if self._is_klippy_busy():
+            # Anything merged now would only apply once the other G-code is done
+            self._knob_dropped_steps += multiplier + abs(self._knob_pending_steps)
+            self._knob_pending_steps = 0
+            return {'status': 'dropped'}
+        if self._knob_pending_steps == 0:
+            self._knob_window_start = time.monotonic()
+        steps = self._knob_pending_steps + (multiplier if key == 'key_up' else -multiplier)
+        limit = self.knob_backlog_limit
+        merged = max(-limit, min(steps, limit))
+        dropped = abs(steps - merged)
+        self._knob_pending_steps = merged
+        self._knob_merged_steps += multiplier - dropped
+        self._knob_dropped_steps += dropped
+        if self.debug_log:
+            self.logger.debug(
+                f"Knob adjustment in flight, pending steps: {merged}, dropped: {dropped}"
+            )
+        return {'status': 'dropped' if dropped == multiplier else 'merged'}
+
+    def _release_knob_slot(self) -> None:
+        """A knob adjustment completed, send the steps merged meanwhile"""
+        self._knob_in_flight = False
+        # An open coalescing window sends them when it closes
+        if self._knob_flush_handle is None:
+            self._send_pending_knob_steps()
+        self._notify_status_update()
+
+    def _is_klippy_busy(self) -> bool:
+        """Klippy is working through G-code other than knob adjustments"""
+        return bool(self._running_jobs) or self._gcode_outstanding > 0
+
+    def _get_knob_backlog(self) -> Dict[str, Any]:
+        return {
+            'gcode_outstanding': self._gcode_outstanding,
+            'adjustment_in_flight': self._knob_in_flight,
+            'pending_steps': self._knob_pending_steps,
+            'merged_steps': self._knob_merged_steps,
+            'dropped_steps': self._knob_dropped_steps
+        }
 
-    # The updated _handle_adjustment method:
-    async def _handle_knob_adjustment(self, key: str) -> None:
+    def _cancel_knob_coalescing(self) -> None:
+        """Drop any knob detents still waiting in the coalescing window"""
+        if self._knob_flush_handle is not None:
+            self._knob_flush_handle.cancel()
+            self._knob_flush_handle = None
+        self._knob_pending_steps = 0
+
+    def _probe_step_size(self, current_z: float) -> float:
+        """Step size for a single probe calibration detent at the given height"""
+        if current_z < self.fine_tune_from:
+            return round(max(current_z * self.probe_fine_multiplier, self.probe_fine_min_step), 3)
+        return round(max(current_z * self.probe_coarse_multiplier, self.probe_min_step), 3)
+
+    def _probe_travel(self, current_z: float, direction: int, steps: int) -> float:
+        """Total travel of several probe detents, the single detent step
+        scaled by the number of steps
+
+        Moving down never covers more than the coarse fraction of the
+        current height, so a fast turn can't drive the nozzle into the bed.
+        """
+        step = self._probe_step_size(current_z)
+        travel = step * steps
+        if direction < 0:
+            travel = min(travel, max(step, current_z * self.probe_coarse_multiplier))
+        return direction * round(travel, 3)
+
+    async def _handle_knob_adjustment(self, key: str, steps: int = 1) -> Dict[str, Any]:
         """Handle immediate adjustment commands (up/down keys)"""
         try:
             if self.debug_log:
-                self.logger.debug(f"Starting adjustment handling - Key: {key}")
+                self.logger.debug(f"Starting adjustment handling - Key: {key}, Steps: {steps}")
 
-            await self._check_klippy_state()
+            await self._refresh_klippy_state()
             if self.debug_log:
                 self.logger.debug(
                     f"Klippy state checked - is_probing: {self.is_probing}, is_printing: {self._is_printing}")
 
-            # Initialize cmd as None
+            # Initialize cmd as None, feedback sounds are collected in script
             cmd = None
+            script: List[str] = []
+            direction = 1 if key == 'key_up' else -1
 
             if self.is_probing:
                 # Get current Z position
@@ -311,25 +1050,22 @@ class NumpadMacros:
                 if self.debug_log:
                     self.logger.debug(f"Probe adjustment - Current Z: {current_z}")
 
-                # Determine step size based on height
+                # Determine feedback based on height
                 if current_z < self.fine_tune_from:  # Use configurable threshold
                     # Fine adjustment mode using configurable multiplier
-                    step_size = max(current_z * self.probe_fine_multiplier, self.probe_fine_min_step)
                     if key == 'key_up':
-                        await self._execute_gcode('_FURTHER_KNOB_PROBE_MICRO_CALIBRATE')
-                        cmd = f"TESTZ Z=+{step_size:.3f}"
+                        self._append_macro(script, '_FURTHER_KNOB_PROBE_MICRO_CALIBRATE')
                     else:
-                        await self._execute_gcode('_NEARER_KNOB_PROBE_MICRO_CALIBRATE')
-                        cmd = f"TESTZ Z=-{step_size:.3f}"
+                        self._append_macro(script, '_NEARER_KNOB_PROBE_MICRO_CALIBRATE')
                 else:
                     # Keep existing coarse adjustment logic
-                    step_size = max(current_z * self.probe_coarse_multiplier, self.probe_min_step)
                     if key == 'key_up':
-                        await self._execute_gcode('_FURTHER_KNOB_PROBE_CALIBRATE')
-                        cmd = f"TESTZ Z=+{step_size:.3f}"
+                        self._append_macro(script, '_FURTHER_KNOB_PROBE_CALIBRATE')
                     else:
-                        await self._execute_gcode('_NEARER_KNOB_PROBE_CALIBRATE')
-                        cmd = f"TESTZ Z=-{step_size:.3f}"
+                        self._append_macro(script, '_NEARER_KNOB_PROBE_CALIBRATE')
+
+                travel = self._probe_travel(current_z, direction, steps)
+                cmd = f"TESTZ Z={travel:+.3f}"
 
             elif self._is_printing:
                 # Get Z height to determine mode
@@ -341,44 +1077,40 @@ class NumpadMacros:
 
                 if current_z <= 1.0:
                     # Z offset adjustment during print
+                    adjustment = direction * self.z_adjust_increment * steps
+                    cmd = f"SET_GCODE_OFFSET Z_ADJUST={adjustment:+g} MOVE=1"
                     if key == 'key_up':
-                        cmd = f"SET_GCODE_OFFSET Z_ADJUST={self.z_adjust_increment} MOVE=1"
-                        adjustment = self.z_adjust_increment
-                        await self._execute_gcode('_FURTHER_KNOB_FIRST_LAYER')  # Sound for up
+                        self._append_macro(script, '_FURTHER_KNOB_FIRST_LAYER')  # Sound for up
                     else:
-                        cmd = f"SET_GCODE_OFFSET Z_ADJUST=-{self.z_adjust_increment} MOVE=1"
-                        adjustment = -self.z_adjust_increment
-                        await self._execute_gcode('_NEARER_KNOB_FIRST_LAYER')   # Sound for down
+                        self._append_macro(script, '_NEARER_KNOB_FIRST_LAYER')   # Sound for down
 
                 else:
                     # Speed adjustment using M220
                     # Get current speed factor
-                    kapis: KlippyAPI = self.server.lookup_component('klippy_apis')
-                    result = await kapis.query_objects({'gcode_move': None})
-                    current_speed = result.get('gcode_move', {}).get('speed_factor', 1.0) * 100
+                    current_speed = await self._get_speed_factor() * 100
 
-                    increment = self.speed_settings["increment"]
+                    increment = self.speed_settings["increment"] * steps
                     max_speed = self.speed_settings["max"]
                     min_speed = self.speed_settings["min"]
 
                     # Calculate new speed value
                     if key == 'key_up':
                         new_speed = min(current_speed + increment, max_speed)
-                        await self._execute_gcode('_INCREASE_KNOB_SPEED')  # Sound for speed up
+                        self._append_macro(script, '_INCREASE_KNOB_SPEED')  # Sound for speed up
                     else:
                         new_speed = max(current_speed - increment, min_speed)
-                        await self._execute_gcode('_DEACREASE_KNOB_SPEED')  # Sound for speed down
+                        self._append_macro(script, '_DEACREASE_KNOB_SPEED')  # Sound for speed down
 
                     cmd = f"M220 S{int(new_speed)}"
 
             else:
                 # Standby mode: Volume control
                 if key == 'key_up':
-                    await self._execute_gcode('_INCREASE_KNOB_VOLUME')  # Sound for volume up
-                    await self._execute_gcode('VOLUME_UP')
+                    self._append_macro(script, '_INCREASE_KNOB_VOLUME')  # Sound for volume up
+                    script.extend(['VOLUME_UP'] * steps)
                 else:
-                    await self._execute_gcode('_DEACREASE_KNOB_VOLUME')  # Sound for volume down
-                    await self._execute_gcode('VOLUME_DOWN')
+                    self._append_macro(script, '_DEACREASE_KNOB_VOLUME')  # Sound for volume down
+                    script.extend(['VOLUME_DOWN'] * steps)
 
                 if self.debug_log:
                     self.logger.debug("No adjustment command was generated")
@@ -387,23 +1119,36 @@ class NumpadMacros:
             if cmd is not None:
                 if self.debug_log:
                     self.logger.debug(f"Executing adjustment command: {cmd}")
-                await self._execute_gcode(f'RESPOND MSG="Numpad macros: {cmd}"')
-                await self._execute_gcode(cmd)
+                script.append(f'RESPOND MSG="Numpad macros: {cmd}"')
+                script.append(cmd)
             else:
                 if self.debug_log:
                     self.logger.debug("No adjustment command was generated")
 
+            await self._execute_gcode_batch(script)
+            if cmd is not None:
+                self._apply_local_adjustment(cmd)
+            if cmd is not None and cmd.startswith('SET_GCODE_OFFSET'):
+                self._schedule_z_offset_save(adjustment)
+            return {'status': 'executed', 'steps': steps}
+
         except Exception as e:
             msg = f"Error handling adjustment: {str(e)}"
             self.logger.exception(msg)
             await self._execute_gcode(f'RESPOND TYPE=error MSG="Numpad macros: {msg}"')
             raise
 
+    async def _refresh_klippy_state(self) -> None:
+        """Update internal state, from the subscription cache when available"""
+        if self._is_subscribed:
+            self._update_state_from_cache()
+            return
+        await self._check_klippy_state()
+
     async def _check_klippy_state(self) -> None:
         """Update internal state based on Klippy status"""
-        kapis: KlippyAPI = self.server.lookup_component('klippy_apis')
         try:
-            result = await kapis.query_objects({
+            result = await self._query_klippy({
                 'print_stats': None,
                 'gcode_macro CHECK_PROBE_STATUS': None  # Query our macro
             })
@@ -412,20 +1157,12 @@ class NumpadMacros:
                 self.logger.debug(f'Klippy state query result: {result}')
                 self.logger.debug(f"CHECK_PROBE_STATUS result: {result.get('gcode_macro CHECK_PROBE_STATUS', {})}")
 
-            probe_status = result.get('gcode_macro CHECK_PROBE_STATUS', {})
-            previous_probing = self.is_probing
-            self.is_probing = probe_status.get('monitor_active', False)
-
-            if self.debug_log:
-                self.logger.debug(f"Probe status change: {previous_probing} -> {self.is_probing}")
-
-            self._is_printing = result.get('print_stats', {}).get('state', '') == 'printing'
-
-            # Get probe status from the macro's variables
-            probe_status = result.get('gcode_macro CHECK_PROBE_STATUS', {})
-            self.is_probing = probe_status.get('monitor_active', False)
+            for obj in ('print_stats', 'gcode_macro CHECK_PROBE_STATUS'):
+                self._klippy_status.setdefault(obj, {}).update(result.get(obj, {}))
+            self._update_state_from_cache()
 
             if self.debug_log:
+                probe_status = result.get('gcode_macro CHECK_PROBE_STATUS', {})
                 await self._execute_gcode(
                     f'RESPOND MSG="Numpad macros: State update - '
                     f'Printing: {self._is_printing}, '
@@ -442,89 +1179,471 @@ class NumpadMacros:
             self._reset_state()
             raise self.server.error(msg, 503)
 
+    async def _subscribe_klippy_objects(self) -> None:
+        """Subscribe to the Klippy objects used by key handling"""
+        kapis: KlippyAPI = self.server.lookup_component('klippy_apis')
+        try:
+            result = await kapis.subscribe_objects(
+                SUBSCRIBED_OBJECTS, self._handle_klippy_status_update
+            )
+        except Exception:
+            self.logger.exception("Failed to subscribe to Klippy objects, falling back to queries")
+            self._is_subscribed = False
+            await self._check_klippy_state()
+            return
+
+        self._klippy_status = {
+            obj: dict(result.get(obj, {})) for obj in SUBSCRIBED_OBJECTS
+        }
+        self._is_subscribed = True
+        if self.debug_log:
+            self.logger.debug(f"Subscribed to Klippy objects: {self._klippy_status}")
+        self._update_state_from_cache()
+        self._notify_status_update()
+
+    def _handle_klippy_status_update(
+            self, status: Dict[str, Any], eventtime: float
+    ) -> None:
+        """Merge a Klippy status update into the local cache"""
+        state_changed = False
+        for obj, fields in status.items():
+            if obj not in self._klippy_status:
+                continue
+            self._klippy_status[obj].update(fields)
+            if obj in ('print_stats', 'gcode_macro CHECK_PROBE_STATUS'):
+                state_changed = True
+
+        if state_changed:
+            previous = (self._is_printing, self.is_probing)
+            self._update_state_from_cache()
+            if previous != (self._is_printing, self.is_probing):
+                if self.debug_log:
+                    self.logger.debug(
+                        f"State changed - is_printing: {self._is_printing}, "
+                        f"is_probing: {self.is_probing}"
+                    )
+                self._notify_status_update()
+
+    def _update_state_from_cache(self) -> None:
+        """Derive printing/probing state from the cached Klippy objects"""
+        probe_status = self._klippy_status.get('gcode_macro CHECK_PROBE_STATUS', {})
+        self.is_probing = bool(probe_status.get('monitor_active', False))
+        print_stats = self._klippy_status.get('print_stats', {})
+        self._is_printing = print_stats.get('state', '') == 'printing'
+
+    def _apply_local_adjustment(self, cmd: str) -> None:
+        """Apply the effect of an adjustment to the cache ahead of Klippy's
+        next status update, so rapid knob presses build on each other"""
+        if not self._is_subscribed:
+            return
+        if cmd.startswith('TESTZ Z='):
+            position = list(self._klippy_status['toolhead'].get('position', [0., 0., 0., 0.]))
+            position[2] += float(cmd[len('TESTZ Z='):])
+            self._klippy_status['toolhead']['position'] = position
+        elif cmd.startswith('M220 S'):
+            self._klippy_status['gcode_move']['speed_factor'] = int(cmd[len('M220 S'):]) / 100.
+
     def get_status(self) -> Dict[str, Any]:
         """Return component status"""
+        status = self._get_static_status()
+        status.update(self._get_dynamic_status())
+        status['listener'] = self._get_listener_health()
+        status['version'] = self._status_version
+        status['static_version'] = self._static_version
+        return status
+
+    def _get_static_status(self) -> Dict[str, Any]:
+        """Parts of the status that only change when the key mapping changes"""
+        return {
+            'command_mapping': self.keymap.command_mapping,
+            'query_mapping': self.keymap.query_mapping,
+            'no_confirm_keys': sorted(self.keymap.no_confirm_keys),
+            'confirmation_keys': sorted(self.keymap.confirmation_keys),
+            'cancel_keys': sorted(self.keymap.cancel_keys),
+            'missing_macros': self._missing_macros
+        }
+
+    def _get_dynamic_status(self) -> Dict[str, Any]:
+        """Parts of the status sent as deltas in status_update notifications"""
         return {
-            'command_mapping': self.command_mapping,
-            'query_mapping': self.initial_query_command_mapping,
             'pending_key': self.pending_key,
             'pending_command': self.pending_command,
             'is_printing': self._is_printing,
             'is_probing': self.is_probing,
-            'no_confirm_keys': list(self.no_confirm_keys),
-            'confirmation_keys': list(self.confirmation_keys)
+            'jobs': self._get_jobs(),
+            'knob_backlog': self._get_knob_backlog(),
+            'listener': self._get_listener_health(volatile=False)
         }
 
-    def _notify_status_update(self) -> None:
-        """Notify clients of status changes"""
+    def _notify_status_update(self, static_changed: bool = False) -> None:
+        """Notify clients of status changes
+
+        Only fields that changed since the last notification are sent, with a
+        version number. Clients that miss a version fetch a full snapshot
+        from /server/numpad/status.
+        """
+        dynamic = self._get_dynamic_status()
+        changes = {
+            field: value for field, value in dynamic.items()
+            if field not in self._notified_status or self._notified_status[field] != value
+        }
+        if static_changed:
+            self._static_version += 1
+            changes.update(self._get_static_status())
+        if not changes:
+            return
+        self._notified_status = dynamic
+        self._status_version += 1
         self.server.send_event(
             "numpad_macros:status_update",
-            self.get_status()
+            {
+                'version': self._status_version,
+                'static_version': self._static_version,
+                'changes': changes
+            }
         )
 
-    def _restart_numpad_event_service(self):
-        """Restart the numpad_event_service using systemctl"""
+    async def _restart_numpad_event_service(self) -> None:
+        """Restart the numpad_event_service using systemctl, without blocking the event loop"""
+        shell_cmd: ShellCommandFactory = self.server.lookup_component('shell_command')
+        self.logger.info(f"Restarting {self.listener_service}...")
+        self._listener_restarts += 1
+        self._listener_ready_pid = None
+        self._listener_restart_requested = time.monotonic()
+        scmd = shell_cmd.build_shell_command(f"systemctl restart {self.listener_service}")
         try:
-            self.logger.info("Restarting numpad_event_service...")
-            subprocess.run(["systemctl", "restart", "numpad_event_service"], check=True)
-            self.logger.info("numpad_event_service restarted successfully.")
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"Failed to restart numpad_event_service: {e}")
+            success = await scmd.run(timeout=30., verbose=False)
+        except Exception:
+            self.logger.exception(f"Failed to restart {self.listener_service}")
+            success = False
+        if success:
+            self.logger.info(f"{self.listener_service} restarted successfully.")
+        else:
+            self.logger.error(f"Failed to restart {self.listener_service}")
+        # Give the restarted listener a full timeout to report in
+        self._listener_heartbeat = time.monotonic()
+        self._notify_status_update()
+
+    def _is_listener_alive(self) -> bool:
+        return time.monotonic() - self._listener_heartbeat <= self.listener_heartbeat_timeout
+
+    def _is_listener_ready(self) -> bool:
+        """The listener registered and is still sending heartbeats"""
+        return (
+            self._listener_ready_pid is not None
+            and self._listener_ready_pid == self._listener_info.get('pid')
+            and self._is_listener_alive()
+        )
+
+    def _schedule_listener_restart(self) -> None:
+        if self._listener_restart_task is not None and not self._listener_restart_task.done():
+            return
+        self._listener_restart_task = self.event_loop.create_task(
+            self._restart_numpad_event_service()
+        )
+
+    def _check_listener(self, eventtime: float) -> float:
+        """Supervisor timer, restart the listener when its heartbeat is missing"""
+        if not self._is_listener_alive():
+            self.logger.warning(
+                f"No heartbeat from {self.listener_service} for "
+                f"{time.monotonic() - self._listener_heartbeat:.1f}s"
+            )
+            self._schedule_listener_restart()
+        # Picks up the listener going quiet in the status deltas
+        self._notify_status_update()
+        return eventtime + self.listener_heartbeat_timeout / 2.
+
+    def _get_listener_health(self, volatile: bool = True) -> Dict[str, Any]:
+        """Listener health, volatile fields change on every check and are
+        left out of status_update deltas"""
+        if self.input_mode != 'service':
+            return {'mode': self.input_mode}
+        health: Dict[str, Any] = {
+            'alive': self._is_listener_alive(),
+            'ready': self._is_listener_ready(),
+            'startup': self._listener_startup,
+            'restarts': self._listener_restarts,
+            'pid': self._listener_info.get('pid'),
+            'backend': self._listener_info.get('backend')
+        }
+        if volatile:
+            started = self._listener_info.get('started')
+            health['last_heartbeat'] = round(time.monotonic() - self._listener_heartbeat, 1)
+            health['uptime'] = round(time.time() - started, 1) if started else None
+            health['stats'] = self._listener_info.get('stats', {})
+        return health
+
+    async def _handle_heartbeat(self, web_request: WebRequest) -> Dict[str, Any]:
+        """Handle heartbeat endpoint, called periodically by the listener"""
+        info = web_request.get_args()
+        if info.get('pid') != self._listener_info.get('pid'):
+            self.logger.info(f"{self.listener_service} reporting in, pid {info.get('pid')}")
+            self._listener_info = info
+            self._listener_heartbeat = time.monotonic()
+            self._notify_status_update()
+        else:
+            self._listener_info = info
+            self._listener_heartbeat = time.monotonic()
+        return {'status': 'ok'}
+
+    async def _handle_register(self, web_request: WebRequest) -> Dict[str, Any]:
+        """Handle register endpoint, called by the listener once its input
+        hook is installed and Moonraker is reachable"""
+        info = dict(web_request.get_args())
+        if self.input_mode == 'direct':
+            self._warn_listener_in_direct_mode(info)
+            return {'status': 'ignored', 'reason': "input_mode is direct"}
+        # Milestones in ms since the listener started
+        startup = dict(info.pop('startup', None) or {})
+        if self._listener_restart_requested is not None:
+            startup['restart_to_ready'] = round(
+                (time.monotonic() - self._listener_restart_requested) * 1000, 1
+            )
+            self._listener_restart_requested = None
+        self._listener_info = info
+        self._listener_startup = startup
+        self._listener_ready_pid = info.get('pid')
+        self._listener_heartbeat = time.monotonic()
+        self.logger.info(
+            f"{self.listener_service} ready, pid {info.get('pid')}, startup {startup}"
+        )
+        self._notify_status_update()
+        return {'status': 'ok'}
+
+    def _warn_listener_in_direct_mode(self, info: Dict[str, Any]) -> None:
+        """Log once per listener process that its events are ignored"""
+        pid = info.get('pid', -1)
+        if pid == self._listener_ignored_pid:
+            return
+        self._listener_ignored_pid = pid
+        self.logger.warning(
+            f"Ignoring {self.listener_service} events, input_mode is direct. "
+            f"Stop it with: systemctl disable --now {self.listener_service}"
+        )
 
     async def _handle_ready(self):
-        """Handle the server ready event by restarting the numpad_event_service"""
+        """Handle the server ready event, restarting the listener only if it went quiet"""
         self.logger.info("Handling server ready event.")
-        self._restart_numpad_event_service()
-        await self._check_klippy_state()
+        if self.input_mode == 'service' and not self._is_listener_alive():
+            self._schedule_listener_restart()
+        await self._index_macros()
+        await self._subscribe_klippy_objects()
+
+    async def _index_macros(self) -> None:
+        """Index the gcode_macro objects Klippy defines
+
+        Runs on every klippy_ready, so the index follows config reloads.
+        """
+        kapis: KlippyAPI = self.server.lookup_component('klippy_apis')
+        objects = await kapis.get_object_list(default=None)
+        if objects is None:
+            self.logger.info("Unable to list Klippy objects, not skipping any macros")
+            self._available_macros = None
+            missing: List[str] = []
+        else:
+            self._available_macros = {
+                obj[len('gcode_macro '):].upper() for obj in objects
+                if obj.startswith('gcode_macro ')
+            }
+            missing = self._find_missing_macros()
+        if missing:
+            self.logger.info(f"Skipping macros missing from the printer config: {missing}")
+        if missing != self._missing_macros:
+            self._missing_macros = missing
+            self._notify_status_update(static_changed=True)
+
+    def _find_missing_macros(self) -> List[str]:
+        """Feedback and query macros of the key map that Klippy lacks"""
+        expected = set(FEEDBACK_MACROS)
+        expected.update(
+            cmd.split(None, 1)[0].upper()
+            for cmd in self.keymap.query_mapping.values()
+        )
+        return sorted(
+            macro for macro in expected if not self._macro_available(macro)
+        )
+
+    def _macro_available(self, command: str) -> bool:
+        """Check a macro command against the index, True while it is unknown"""
+        if self._available_macros is None:
+            return True
+        return command.split(None, 1)[0].upper() in self._available_macros
+
+    def _append_macro(self, script: List[str], macro: str) -> None:
+        """Add a feedback macro to a script if Klippy defines it"""
+        if self._macro_available(macro):
+            script.append(macro)
 
     async def _handle_shutdown(self):
         """Handle the server shutdown event"""
         self.logger.info("Handling server shutdown event.")
         self._reset_state()
 
+    async def _handle_disconnect(self):
+        """Drop the Klippy object cache, the subscription ends with the connection"""
+        self._is_subscribed = False
+        self._klippy_status = {}
+
+    def _schedule_z_offset_save(self, adjustment: float) -> None:
+        """Accumulate a first layer Z adjustment and restart the save timer
+
+        Only the trailing edge of a burst of adjustments is saved, so any
+        number of knob clicks within z_offset_save_delay is one disk write.
+        """
+        self._accumulated_z_adjust += adjustment
+        self._pending_z_offset_save = True
+        self._last_z_adjust_time = time.monotonic()
+        self._cancel_z_offset_save()
+        self._z_offset_save_task = self.event_loop.create_task(
+            self._delayed_save_z_offset()
+        )
+
+    def _cancel_z_offset_save(self) -> None:
+        if self._z_offset_save_task is not None:
+            self._z_offset_save_task.cancel()
+            self._z_offset_save_task = None
+
     async def _delayed_save_z_offset(self) -> None:
         """Save the Z adjustment by modifying true_max_height"""
+        # Not part of the key event that scheduled the save
+        _current_trace.set(None)
         try:
-            # Wait for the delay period
+            # Wait for the delay period, a newer adjustment cancels the wait
             await asyncio.sleep(self.z_offset_save_delay)
+            self._z_offset_save_task = None
+            if not self._pending_z_offset_save:
+                return
 
-            # Only proceed if this is the most recent adjustment
-            if self._pending_z_offset_save:
-                # Get current true_max_height
-                kapis: KlippyAPI = self.server.lookup_component('klippy_apis')
-                result = await kapis.query_objects({'save_variables': None})
-                current_true_max = result.get('save_variables', {}).get('variables', {}).get('true_max_height', 0.0)
-                
-                # For positive adjustment (up), subtract from true_max_height
-                # For negative adjustment (down), add to true_max_height
-                new_true_max = float(current_true_max) - self._accumulated_z_adjust
-
-                # Save the new true_max_height
-                await self._execute_gcode(
-                    f'SAVE_VARIABLE VARIABLE=true_max_height VALUE={new_true_max}'
-                )
+            # Adjustments made while saving go into the next save
+            z_adjust = self._accumulated_z_adjust
+            self._accumulated_z_adjust = 0.0
+            self._pending_z_offset_save = False
 
-                if self.debug_log:
-                    self.logger.debug(
-                        f"Adjusted true_max_height: current({current_true_max}) adjusted by "
-                        f"(-{self._accumulated_z_adjust}) = new({new_true_max})"
-                    )
+            # Get current true_max_height
+            result = await self._query_klippy({'save_variables': None})
+            current_true_max = result.get('save_variables', {}).get('variables', {}).get('true_max_height', 0.0)
 
-                # Reset tracking variables
-                self._accumulated_z_adjust = 0.0
-                self._pending_z_offset_save = False
+            # For positive adjustment (up), subtract from true_max_height
+            # For negative adjustment (down), add to true_max_height
+            new_true_max = round(float(current_true_max) - z_adjust, 6)
 
-                # Update park_z with new true_max_height
-                await self._execute_gcode('UPDATE_PARK_Z')
+            # Save the new true_max_height and update park_z with it
+            await self._execute_gcode_batch([
+                f'SAVE_VARIABLE VARIABLE=true_max_height VALUE={new_true_max}',
+                'UPDATE_PARK_Z'
+            ])
+
+            if self.debug_log:
+                self.logger.debug(
+                    f"Adjusted true_max_height: current({current_true_max}) adjusted by "
+                    f"(-{z_adjust}) = new({new_true_max})"
+                )
 
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             self.logger.exception("Error saving Z adjustment")
             await self._execute_gcode(
                 f'RESPOND TYPE=error MSG="Error saving Z adjustment: {str(e)}"'
             )
 
+    def _check_input_devices(self, eventtime: float) -> float:
+        """Open configured input devices that are not open yet (direct mode)"""
+        for path in self.input_devices:
+            if path in self._open_devices:
+                continue
+            try:
+                device = evdev.InputDevice(path)
+                if self.grab_input_devices:
+                    device.grab()
+            except OSError as e:
+                if self.debug_log:
+                    self.logger.debug(f"Input device {path} not available: {e}")
+                continue
+            self._open_devices[path] = device
+            self.event_loop.add_reader(device.fd, self._read_input_device, path)
+            self.logger.info(f"Reading numpad input from {path} ({device.name})")
+        return eventtime + 2.
+
+    def _close_input_device(self, path: str) -> None:
+        device = self._open_devices.pop(path, None)
+        if device is None:
+            return
+        self.event_loop.remove_reader(device.fd)
+        try:
+            device.close()
+        except OSError:
+            pass
+
+    def _read_input_device(self, path: str) -> None:
+        """Non-blocking read of pending events from an input device"""
+        device = self._open_devices[path]
+        try:
+            events = list(device.read())
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.logger.warning(f"Lost input device {path}: {e}")
+            self._close_input_device(path)
+            return
+
+        for input_event in events:
+            # Value 1 is a key press and 2 an autorepeat, matching the listener
+            if input_event.type != evdev.ecodes.EV_KEY or input_event.value not in (1, 2):
+                continue
+            key = INPUT_KEY_MAPPING.get(input_event.code)
+            if key is None:
+                continue
+            now = time.monotonic()
+            # Every detent counts towards the knob velocity, debounced or not
+            multiplier = None
+            if key in KNOB_KEYS:
+                multiplier = self._get_input_knob_multiplier(key, now)
+            debounce = self.knob_input_debounce if key in KNOB_KEYS else self.input_debounce
+            if now - self._last_input_time.get(key, -debounce) < debounce:
+                continue
+            self._last_input_time[key] = now
+            event = {
+                'key': key,
+                'scan_code': input_event.code,
+                'event_type': 'down',
+                'time': time.time()
+            }
+            if multiplier is not None:
+                event['multiplier'] = multiplier
+            self.event_loop.register_callback(self._process_numpad_event, event)
+
+    def _get_input_knob_multiplier(self, key: str, now: float) -> int:
+        """Record a knob detent and return the step multiplier for its velocity"""
+        detents = self._knob_detent_times[key]
+        detents.append(now)
+        while detents and now - detents[0] > KNOB_VELOCITY_WINDOW:
+            detents.popleft()
+        velocity = len(detents) / KNOB_VELOCITY_WINDOW
+        for min_velocity, multiplier in KNOB_ACCELERATION:
+            if velocity >= min_velocity:
+                return multiplier
+        return 1
+
+    async def close(self) -> None:
+        if self._event_consumer is not None:
+            self._event_consumer.cancel()
+        self._cancel_z_offset_save()
+        for job in list(self._running_jobs.values()):
+            if job.task is not None:
+                job.task.cancel()
+        for task in list(self._background_scripts):
+            task.cancel()
+        self._supervisor_timer.stop()
+        self._input_timer.stop()
+        for path in list(self._open_devices):
+            self._close_input_device(path)
+
     def _reset_state(self) -> None:
         """Reset all state variables"""
+        self._cancel_knob_coalescing()
+        self._cancel_z_offset_save()
         self.pending_key = None
         self.pending_command = None
         self._is_printing = False
@@ -536,23 +1655,191 @@ class NumpadMacros:
 
     async def _get_toolhead_position(self) -> Dict[str, float]:
         """Get current toolhead position"""
-        kapis: KlippyAPI = self.server.lookup_component('klippy_apis')
-        result = await kapis.query_objects({'toolhead': None})
-        pos = result.get('toolhead', {}).get('position', [0., 0., 0., 0.])
+        if self._is_subscribed:
+            pos = self._klippy_status['toolhead'].get('position', [0., 0., 0., 0.])
+        else:
+            result = await self._query_klippy({'toolhead': None})
+            pos = result.get('toolhead', {}).get('position', [0., 0., 0., 0.])
         return {
             'x': pos[0], 'y': pos[1], 'z': pos[2], 'e': pos[3]
         }
 
+    async def _get_speed_factor(self) -> float:
+        """Get current speed factor"""
+        if self._is_subscribed:
+            return self._klippy_status['gcode_move'].get('speed_factor', 1.0)
+        result = await self._query_klippy({'gcode_move': None})
+        return result.get('gcode_move', {}).get('speed_factor', 1.0)
+
+    async def _query_klippy(self, objects: Dict[str, Any]) -> Dict[str, Any]:
+        """Query Klippy objects, timing the call for the current event"""
+        kapis: KlippyAPI = self.server.lookup_component('klippy_apis')
+        start = time.monotonic()
+        try:
+            return await kapis.query_objects(objects)
+        finally:
+            self._add_stage_time('klippy_query', start)
+
     async def _execute_gcode(self, command: str) -> None:
         """Execute a gcode command"""
         kapis: KlippyAPI = self.server.lookup_component('klippy_apis')
-        await kapis.run_gcode(command)
+        start = time.monotonic()
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.gcode.append(command)
+        counted = trace is None or trace.key_class != 'knob'
+        if counted:
+            self._gcode_outstanding += 1
+        try:
+            await kapis.run_gcode(command)
+        finally:
+            if counted:
+                self._gcode_outstanding -= 1
+            self._add_stage_time('run_gcode', start)
+
+    def _add_stage_time(self, stage: str, start: float) -> None:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, (time.monotonic() - start) * 1000.)
+
+    def _get_key_class(self, key: str) -> str:
+        return self.keymap.key_classes.get(key, 'unbound')
+
+    def _get_printer_mode(self) -> str:
+        if self.is_probing:
+            return 'probing'
+        if self._is_printing:
+            return 'printing'
+        return 'standby'
+
+    def _record_trace(self, trace: EventTrace) -> None:
+        """Fold a finished event trace into the latency histograms"""
+        trace.add('total', (time.monotonic() - trace.start) * 1000.)
+        for stage, ms in trace.stages.items():
+            hist_key = (stage, trace.key_class, trace.mode)
+            histogram = self._latency.get(hist_key)
+            if histogram is None:
+                histogram = self._latency[hist_key] = LatencyHistogram()
+            histogram.observe(ms)
+
+    def _record_history(
+            self, trace: EventTrace, result: Any, error: Optional[BaseException]
+    ) -> None:
+        """Add a compact record of a handled event to the flight recorder"""
+        if not isinstance(result, dict):
+            result = {}
+        status = result.get('status')
+        if error is not None:
+            outcome = 'error'
+        elif status == 'superseded':
+            outcome = 'superseded'
+        else:
+            outcome = 'ok'
+        record = {
+            'time': round(time.time(), 3),
+            'key': trace.key,
+            'key_class': trace.key_class,
+            'mode': trace.mode,
+            'action': status,
+            'job_id': result.get('job_id'),
+            'gcode': trace.gcode,
+            'stages_ms': {stage: round(ms, 3) for stage, ms in trace.stages.items()},
+            'outcome': outcome,
+            'error': None if error is None else str(error)
+        }
+        job = self._find_job(result.get('job_id'))
+        if job is not None:
+            # The confirmed command runs on after the key event
+            record['gcode'] = [job.command]
+            job.record = record
+            self._update_job_record(job)
+        self._history.append(record)
+
+    def _find_job(self, job_id: Optional[int]) -> Optional[CommandJob]:
+        if job_id is None:
+            return None
+        if job_id in self._running_jobs:
+            return self._running_jobs[job_id]
+        return next((job for job in self._jobs if job.job_id == job_id), None)
+
+    def _update_job_record(self, job: CommandJob) -> None:
+        """Copy a job's state to the history record of its confirmation"""
+        if job.record is None:
+            return
+        if job.state == 'running':
+            job.record['outcome'] = 'running'
+        else:
+            job.record['outcome'] = 'ok' if job.state == 'succeeded' else 'error'
+            job.record['error'] = job.error
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Latency percentiles per stage, key class and printer mode"""
+        metrics: Dict[str, Any] = {}
+        for (stage, key_class, mode), histogram in sorted(self._latency.items()):
+            metrics.setdefault(stage, {}).setdefault(key_class, {})[mode] = histogram.as_dict()
+        return {'buckets_ms': list(LATENCY_BUCKETS_MS), 'latency': metrics}
+
+    def get_prometheus_metrics(self) -> str:
+        """Latency histograms in the Prometheus text exposition format"""
+        name = "numpad_macros_latency_seconds"
+        lines = [
+            f"# HELP {name} Key event latency per processing stage",
+            f"# TYPE {name} histogram"
+        ]
+        for (stage, key_class, mode), histogram in sorted(self._latency.items()):
+            labels = f'stage="{stage}",key_class="{key_class}",mode="{mode}"'
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS_MS, histogram.bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{labels},le="{bound / 1000.}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{{labels}}} {histogram.sum_ms / 1000.}')
+            lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    async def _execute_gcode_batch(self, commands: List[str]) -> None:
+        """Execute several gcode commands, as one script when batching is enabled"""
+        if not commands:
+            return
+        if self.batch_gcode:
+            await self._execute_gcode('\n'.join(commands))
+            return
+        # Per-line mode, a failing line is reported on its own
+        for command in commands:
+            await self._execute_gcode(command)
 
     async def _handle_status_request(
             self, web_request: WebRequest
     ) -> Dict[str, Any]:
-        """Handle status request endpoint"""
-        return {'status': self.get_status()}
+        """Handle status request endpoint
+
+        With a version argument matching the current version only the
+        version is returned, otherwise a full snapshot.
+        """
+        version = web_request.get_int('version', None)
+        if version is not None and version == self._status_version:
+            return {'version': self._status_version, 'changed': False}
+        return {'version': self._status_version, 'changed': True, 'status': self.get_status()}
+
+    async def _handle_history_request(
+            self, web_request: WebRequest
+    ) -> Dict[str, Any]:
+        """Handle history request endpoint, the most recent events last"""
+        count = web_request.get_int('count', None)
+        events = list(self._history)
+        if count is not None:
+            events = events[-count:] if count > 0 else []
+        return {'size': self._history.maxlen, 'events': events}
+
+    async def _handle_metrics_request(
+            self, web_request: WebRequest
+    ) -> Dict[str, Any]:
+        """Handle metrics request endpoint"""
+        return self.get_metrics()
+
+    async def _handle_prometheus_request(self, web_request: WebRequest) -> str:
+        """Handle Prometheus metrics endpoint, the text exposition format"""
+        return self.get_prometheus_metrics()
 
 def load_component(config: ConfigHelper) -> NumpadMacros:
     return NumpadMacros(config)
\ No newline at end of file
@@ -1,28 +1,134 @@
 #!/usr/bin/env python3
-import keyboard
-import requests
-import json
 import time
+STARTED_MONOTONIC = time.monotonic()
+
+import atexit
+import collections
+import functools
+import json
+import os
+import socket
+import threading
 import logging
-from logging.handlers import RotatingFileHandler
-from typing import Dict, Optional
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# Imported on demand so the input hook is live before the slower modules
+# load: keyboard by run_keyboard_backend, asyncio, evdev and inotify_simple
+# by run_evdev_backend, requests and websocket by load_transport
+keyboard: Any = None
+asyncio: Any = None
+evdev: Any = None
+INotify: Any = None
+inotify_flags: Any = None
+requests: Any = None
+websocket: Any = None
 
 # Configuration
 MOONRAKER_URL = "http://localhost:7125"
+MOONRAKER_WS_URL = "ws://localhost:7125/websocket"
+MOONRAKER_UNIX_SOCKET = "/home/pi/printer_data/comms/moonraker.sock"
+# "unix" (persistent JSON-RPC over Moonraker's Unix socket, falling back to
+# the websocket when the socket is unavailable), "websocket" (persistent
+# JSON-RPC over TCP) or "http" (one POST per event)
+TRANSPORT = "unix"
+TRANSPORTS = ("unix", "websocket", "http")
 LOG_FILE = "/home/pi/printer_data/logs/numpad_event_service.log"
 MAX_LOG_SIZE = 5 * 1024 * 1024  # 5 MB
 BACKUP_COUNT = 3
+LOG_LEVEL = "INFO"
+# Per-event log lines are limited to one per key every EVENT_LOG_INTERVAL
+# seconds, the suppressed count is added to the next line (0 logs every event)
+EVENT_LOG_INTERVAL = 1.0
 
 # Debounce configuration (in milliseconds)
 DEBOUNCE_CONFIG = {
-    "key_up": 600,    # 600ms for up key
-    "key_down": 600,  # 600ms for down key
+    "key_up": 100,    # 100ms for up key, faster turns raise the step multiplier
+    "key_down": 100,  # 100ms for down key
     "default": 200     # 50ms default for other keys
 }
 
+# Knob acceleration: the rotation velocity (detents per second over the last
+# KNOB_VELOCITY_WINDOW seconds) picks the step multiplier sent with each event
+KNOB_VELOCITY_WINDOW = 0.5
+KNOB_ACCELERATION = [  # (minimum detents per second, step multiplier)
+    (15, 8),
+    (10, 4),
+    (5, 2),
+    (0, 1)
+]
+
 # Request timeout (in seconds)
 REQUEST_TIMEOUT = 0.5  # 500ms timeout for Moonraker requests
 
+# Send queue between the keyboard hook and the sender thread
+SEND_QUEUE_SIZE = 32
+KNOB_KEYS = ("key_up", "key_down")
+
+# Events older than their TTL (in seconds) are discarded instead of sent late,
+# keys without an entry use the "default" TTL (None never expires). Knob
+# turns are stale quickly, command and enter keys are kept through a
+# Moonraker restart
+EVENT_TTL = {
+    "key_up": 0.3,
+    "key_down": 0.3,
+    "default": 30.0
+}
+
+# Backoff (in seconds) between delivery attempts while Moonraker is unreachable
+RETRY_BACKOFF_MIN = 0.1
+RETRY_BACKOFF_MAX = 2.0
+
+# Seconds between heartbeats to the component, which restarts the service
+# when they stop
+HEARTBEAT_INTERVAL = 5.0
+STARTED_AT = time.time()
+# Seconds between registration attempts until the component has the listener
+REGISTER_RETRY_INTERVAL = 0.2
+
+# Websocket reconnect backoff (in seconds)
+RECONNECT_BACKOFF_MIN = 0.5
+RECONNECT_BACKOFF_MAX = 10.0
+
+# Input backend: "keyboard" hooks every keyboard on the system, "evdev" reads
+# only the INPUT_DEVICES with asyncio and reopens them when they are plugged in
+INPUT_BACKEND = "keyboard"
+INPUT_DEVICES: List[str] = []  # e.g. "/dev/input/by-id/usb-<numpad>-event-kbd"
+GRAB_DEVICES = False  # evdev only, keep the numpad's keys away from other programs
+INPUT_WATCH_DIRS = ("/dev/input", "/dev/input/by-id", "/dev/input/by-path")
+
+# Printers served by this listener, each with its own numpads (evdev backend
+# only). Empty sends the INPUT_DEVICES to the Moonraker configured above.
+# Options missing from a target default to the settings above, e.g.
+# {"printer_2": {"moonraker_unix_socket": "/home/pi/printer_2_data/comms/moonraker.sock",
+#                "moonraker_url": "http://localhost:7126",
+#                "moonraker_ws_url": "ws://localhost:7126/websocket",
+#                "input_devices": ["/dev/input/by-path/...-usb-0:1.2:1.0-event-kbd"]}}
+TARGETS: Dict[str, Dict[str, Any]] = {}
+
+# Optional trace of every key down event and its debounce decision, for
+# replaying with numpad_replay.py, e.g.
+# "/home/pi/printer_data/logs/numpad_trace.jsonl". Every start appends a new
+# segment, past TRACE_MAX_SIZE bytes the file moves to TRACE_FILE.1. Empty
+# disables
+TRACE_FILE = ""
+TRACE_MAX_SIZE = 5 * 1024 * 1024  # 5 MB
+TRACE_VERSION = 1
+
+# Optional JSON file overriding the settings above, using lowercase names:
+# {"input_backend": "evdev", "input_devices": ["/dev/input/by-id/..."]}
+CONFIG_FILE = "/home/pi/printer_data/config/numpad_event_service.json"
+CONFIGURABLE_SETTINGS = (
+    "MOONRAKER_URL", "MOONRAKER_WS_URL", "MOONRAKER_UNIX_SOCKET", "TRANSPORT",
+    "DEBOUNCE_CONFIG",
+    "REQUEST_TIMEOUT", "SEND_QUEUE_SIZE", "EVENT_TTL", "RETRY_BACKOFF_MIN",
+    "RETRY_BACKOFF_MAX", "KNOB_VELOCITY_WINDOW",
+    "KNOB_ACCELERATION", "INPUT_BACKEND",
+    "INPUT_DEVICES", "GRAB_DEVICES", "TARGETS", "HEARTBEAT_INTERVAL", "LOG_LEVEL",
+    "EVENT_LOG_INTERVAL", "TRACE_FILE", "TRACE_MAX_SIZE"
+)
+
 # Scan code to key name mapping
 SCAN_CODE_MAPPING = {
     # Numpad specific keys
@@ -71,28 +177,563 @@ SCAN_CODE_MAPPING = {
 # Set up logging
 logger = logging.getLogger("NumpadListener")
 logger.setLevel(logging.INFO)
-handler = RotatingFileHandler(LOG_FILE, maxBytes=MAX_LOG_SIZE, backupCount=BACKUP_COUNT)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
-# Debounce state tracking
-last_key_time: Dict[str, float] = {}
+def setup_logging() -> QueueListener:
+    """Route log records through a queue to a background writer thread
+
+    The input and sender threads only enqueue records, so SD card writes and
+    log rotation never delay key delivery.
+    """
+    handler = RotatingFileHandler(LOG_FILE, maxBytes=MAX_LOG_SIZE, backupCount=BACKUP_COUNT)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handler.setFormatter(formatter)
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, handler)
+    log_listener.start()
+    return log_listener
+
+class EventLogSampler:
+    """Rate limits per-event log lines, one per message and key every
+    EVENT_LOG_INTERVAL seconds"""
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.last_logged: Dict[Tuple[str, str], float] = {}
+        self.suppressed: Dict[Tuple[str, str], int] = collections.Counter()
+        # Level and arguments of the last suppressed line, for flush()
+        self.last_suppressed: Dict[Tuple[str, str], Tuple[int, Tuple[Any, ...]]] = {}
+
+    def log(self, level: int, key: str, msg: str, *args: Any) -> None:
+        if not logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        sample_key = (msg, key)
+        with self.lock:
+            last = self.last_logged.get(sample_key)
+            if last is not None and now - last < EVENT_LOG_INTERVAL:
+                self.suppressed[sample_key] += 1
+                self.last_suppressed[sample_key] = (level, args)
+                return
+            self.last_logged[sample_key] = now
+            suppressed = self.suppressed.pop(sample_key, 0)
+            self.last_suppressed.pop(sample_key, None)
+        if suppressed:
+            msg += " (%d similar suppressed)"
+            args += (suppressed,)
+        logger.log(level, msg, *args)
+
+    def flush(self) -> None:
+        """Log the last suppressed line of every key that went quiet, so its
+        count is not held back until the next event"""
+        now = time.monotonic()
+        lines = []
+        with self.lock:
+            for sample_key, suppressed in list(self.suppressed.items()):
+                if now - self.last_logged[sample_key] < EVENT_LOG_INTERVAL:
+                    continue
+                del self.suppressed[sample_key]
+                self.last_logged[sample_key] = now
+                level, args = self.last_suppressed.pop(sample_key)
+                lines.append((level, sample_key[0] + " (%d similar suppressed)", args + (suppressed,)))
+        for level, msg, args in lines:
+            logger.log(level, msg, *args)
+
+event_log = EventLogSampler()
+
+class TraceRecorder:
+    """Writes key down events and their debounce decisions to TRACE_FILE
+
+    Each listener start appends a segment: a JSON header with the settings
+    that shape the decisions, followed by one compact JSON array per event:
+    [ms since recording started, scan code, key name, mapped key, target,
+    decision, knob multiplier]. Past TRACE_MAX_SIZE the file is moved to
+    TRACE_FILE.1 and the segment continues in a new file, so traces from
+    before a restart are kept. The file is written on a background thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started = time.monotonic()
+        self.records: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._write, name="TraceRecorder", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def record(self, event_time: float, scan_code: int, name: str, key_name: str,
+               target: str, decision: str, multiplier: Optional[int]):
+        self.records.put([round((event_time - self.started) * 1000, 1), scan_code, name,
+                          key_name, target, decision, multiplier])
+
+    def _write(self):
+        header = {
+            "trace": TRACE_VERSION,
+            "started": time.time() - (time.monotonic() - self.started),
+            "backend": INPUT_BACKEND,
+            # Same names as the config file, the replayer applies them
+            "settings": {
+                "debounce_config": DEBOUNCE_CONFIG,
+                "knob_velocity_window": KNOB_VELOCITY_WINDOW,
+                "knob_acceleration": KNOB_ACCELERATION,
+                "event_ttl": EVENT_TTL
+            }
+        }
+        f = self._open(header)
+        while True:
+            record = self.records.get()
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            if self.records.empty():
+                f.flush()
+                if f.tell() > TRACE_MAX_SIZE:
+                    f.close()
+                    f = self._open(header)
+
+    def _open(self, header: Dict[str, Any]):
+        """Open the trace for appending a segment, rotating it when full"""
+        if os.path.exists(self.path) and os.path.getsize(self.path) > TRACE_MAX_SIZE:
+            os.replace(self.path, self.path + ".1")
+        f = open(self.path, "a")
+        f.write(json.dumps(header) + "\n")
+        f.flush()
+        return f
+
+trace_recorder: Optional[TraceRecorder] = None
+
+# Startup milestones in ms since the module started loading, sent to the
+# component when registering: hook_ready, transport_loaded
+startup_timing: Dict[str, float] = {}
+
+def mark_startup(milestone: str):
+    startup_timing[milestone] = round((time.monotonic() - STARTED_MONOTONIC) * 1000, 1)
+
+def sd_notify(state: str):
+    """Send a state change to systemd when running as a Type=notify service"""
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return
+    if address.startswith("@"):
+        # Abstract namespace socket
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+    except OSError as e:
+        logger.warning(f"Unable to notify systemd: {e}")
+
+def load_transport():
+    """Import the modules used to reach Moonraker"""
+    global requests, websocket
+    import requests
+    import websocket
+    mark_startup("transport_loaded")
+
+
+class EventQueue:
+    """Bounded queue between the keyboard hook and the sender thread
+
+    When the queue is full the oldest knob event makes room for the new
+    one. Enter and command keys are never dropped, even if that takes the
+    queue over its size.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.events: Deque[Tuple[float, Dict[str, Any]]] = collections.deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, event_data: Dict[str, Any]) -> bool:
+        with self.cond:
+            if len(self.events) >= self.maxsize and not self._drop_oldest_knob():
+                if event_data["key"] in KNOB_KEYS:
+                    self.dropped += 1
+                    return False
+            self.events.append((time.monotonic(), event_data))
+            self.cond.notify()
+            return True
+
+    def get(self) -> Tuple[float, Dict[str, Any]]:
+        """Block until an event is available, returns (enqueue time, event)"""
+        with self.cond:
+            while not self.events:
+                self.cond.wait()
+            return self.events.popleft()
+
+    def requeue(self, enqueued: float, event_data: Dict[str, Any]):
+        """Put back an event Moonraker did not handle, in enqueue order"""
+        with self.cond:
+            index = 0
+            while index < len(self.events) and self.events[index][0] <= enqueued:
+                index += 1
+            self.events.insert(index, (enqueued, event_data))
+            self.cond.notify()
+
+    def _drop_oldest_knob(self) -> bool:
+        for entry in self.events:
+            if entry[1]["key"] in KNOB_KEYS:
+                self.events.remove(entry)
+                self.dropped += 1
+                return True
+        return False
+
+class UnixSocketStream:
+    """Connection to Moonraker's Unix socket
+
+    Carries the same JSON-RPC messages as the websocket, each terminated
+    by an ETX (0x03) byte.
+    """
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.settimeout(REQUEST_TIMEOUT * 10)
+            self.sock.connect(path)
+            self.sock.settimeout(None)
+        except OSError:
+            self.sock.close()
+            raise
+        self.buffer = b""
+
+    def send(self, message: str):
+        self.sock.sendall(message.encode() + b"\x03")
+
+    def recv(self) -> str:
+        while b"\x03" not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError("connection closed by Moonraker")
+            self.buffer += data
+        message, _, self.buffer = self.buffer.partition(b"\x03")
+        return message.decode()
+
+    def close(self):
+        self.sock.close()
+
+class MoonrakerConnection:
+    """Persistent JSON-RPC connection to Moonraker
+
+    A background thread keeps the connection open, reconnecting with
+    exponential backoff, and reads responses and notifications from it.
+    With a Unix socket path it is tried first on every (re)connect, the
+    websocket is the fallback.
+    """
+
+    def __init__(self, ws_url: str, unix_socket: Optional[str] = None, name: str = "default"):
+        self.ws_url = ws_url
+        self.unix_socket = unix_socket
+        self.stream: Optional[Any] = None
+        self.connected = threading.Event()
+        # Incremented on every (re)connect, the listener registers again
+        # with a restarted Moonraker
+        self.connections = 0
+        self.send_lock = threading.Lock()
+        self.next_id = 0
+        # Requests waiting for their response: id -> (method, callback that
+        # gets the JSON-RPC error, None on success)
+        self.pending: Dict[int, Tuple[str, Optional[Callable[[Optional[Dict[str, Any]]], None]]]] = {}
+        self.numpad_status: Dict[str, Any] = {}
+        self.thread = threading.Thread(target=self._run, name=f"MoonrakerConnection-{name}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _connect(self) -> Tuple[Any, str]:
+        """Open the Unix socket, or the websocket when that fails"""
+        if self.unix_socket is not None:
+            try:
+                return UnixSocketStream(self.unix_socket), f"Unix socket {self.unix_socket}"
+            except OSError as e:
+                logger.info(f"Moonraker Unix socket unavailable ({e}), falling back to the websocket")
+        ws = websocket.create_connection(self.ws_url, timeout=REQUEST_TIMEOUT * 10)
+        ws.settimeout(None)
+        return ws, f"websocket {self.ws_url}"
+
+    def _run(self):
+        backoff = RECONNECT_BACKOFF_MIN
+        while True:
+            try:
+                stream, description = self._connect()
+            except (OSError, websocket.WebSocketException) as e:
+                logger.warning(f"Unable to connect to Moonraker ({e}), retrying in {backoff:.1f}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                continue
+
+            self.stream = stream
+            backoff = RECONNECT_BACKOFF_MIN
+            self.connections += 1
+            self.connected.set()
+            logger.info(f"Connected to Moonraker over {description}")
+            self.call("server.connection.identify", {
+                "client_name": "numpad_event_service",
+                "version": "2.0.0",
+                "type": "other",
+                "url": "https://github.com/CWE3D/lister_numpad_macros"
+            })
+
+            try:
+                while True:
+                    self._handle_message(stream.recv())
+            except (OSError, websocket.WebSocketException) as e:
+                logger.warning(f"Moonraker connection lost: {e}")
+            finally:
+                self.connected.clear()
+                with self.send_lock:
+                    self.stream = None
+                    pending, self.pending = self.pending, {}
+                stream.close()
+                # Moonraker may or may not have handled these
+                for request_id, (method, on_response) in sorted(pending.items()):
+                    if on_response is not None:
+                        on_response({"code": 503, "message": "connection lost before the response"})
+
+    def _handle_message(self, message: str):
+        try:
+            data = json.loads(message)
+        except ValueError:
+            logger.error(f"Invalid message from Moonraker: {message}")
+            return
+
+        if "id" in data:
+            method, on_response = self.pending.pop(data["id"], ("unknown", None))
+            error = data.get("error")
+            if error is not None:
+                logger.error(f"Moonraker returned an error for {method}: {error}")
+            if on_response is not None:
+                on_response(error)
+            return
+
+        # Klippy's own notify_status_update is only sent to clients that
+        # subscribed to printer objects, so here it is always ours. It only
+        # carries the fields that changed since the previous version
+        if data.get("method") == "notify_status_update":
+            params = data.get("params") or [{}]
+            self.numpad_status.update(params[0].get("changes", {}))
+            self.numpad_status["version"] = params[0].get("version")
+            logger.debug("Numpad status update: %s", params[0])
+
+    def call(self, method: str, params: Dict[str, Any],
+             on_response: Optional[Callable[[Optional[Dict[str, Any]]], None]] = None) -> bool:
+        """Send a JSON-RPC request without waiting for the response
+
+        on_response is called from the connection thread with the error of
+        the response, None on success. A lost connection counts as an error.
+        """
+        with self.send_lock:
+            stream = self.stream
+            if stream is None or not self.connected.is_set():
+                return False
+            self.next_id += 1
+            request_id = self.next_id
+            self.pending[request_id] = (method, on_response)
+            try:
+                stream.send(json.dumps({
+                    "jsonrpc": "2.0",
+                    "method": method,
+                    "params": params,
+                    "id": request_id
+                }))
+            except (OSError, websocket.WebSocketException) as e:
+                self.pending.pop(request_id, None)
+                logger.error(f"Error sending {method} to Moonraker: {e}")
+                return False
+        return True
+
+class Target:
+    """A Moonraker instance that key events are sent to
+
+    Every target has its own debounce state, send queue, sender thread and
+    connection, so one printer's slow requests never hold up another's keys.
+    """
+
+    def __init__(self, name: str, settings: Dict[str, Any]):
+        self.name = name
+        self.moonraker_url = settings.get("moonraker_url", MOONRAKER_URL)
+        self.moonraker_ws_url = settings.get("moonraker_ws_url", MOONRAKER_WS_URL)
+        self.moonraker_unix_socket = settings.get("moonraker_unix_socket", MOONRAKER_UNIX_SOCKET)
+        self.transport = settings.get("transport", TRANSPORT)
+        if self.transport not in TRANSPORTS:
+            raise RuntimeError(f"Unknown transport '{self.transport}' for target {name}, "
+                               f"expected one of {', '.join(TRANSPORTS)}")
+        self.input_devices: List[str] = settings.get("input_devices", [])
+        # Event counters: debounced, queued, dropped, expired, retried, sent, failed
+        self.stats: Dict[str, int] = collections.Counter()
+        # Backoff after Moonraker answered an event with an error
+        self.retry_backoff = RETRY_BACKOFF_MIN
+        self.retry_at = 0.
+        # Debounce state tracking (time.monotonic)
+        self.last_key_time: Dict[str, float] = {}
+        self.knob_detent_times: Dict[str, Deque[float]] = collections.defaultdict(collections.deque)
+        # Buffers key events from the moment the input hook is installed,
+        # until the transport is up
+        self.send_queue = EventQueue(SEND_QUEUE_SIZE)
+        # Keeps the HTTP connection to Moonraker open between events
+        self.session: Optional["requests.Session"] = None
+        self.conn: Optional[MoonrakerConnection] = None
+
+    def connect(self):
+        """Open the target's transport, needs load_transport()"""
+        self.session = requests.Session()
+        if self.transport != "http":
+            unix_socket = self.moonraker_unix_socket if self.transport == "unix" else None
+            self.conn = MoonrakerConnection(self.moonraker_ws_url, unix_socket, self.name)
+            self.conn.start()
+
+    def start(self):
+        self.connect()
+        threading.Thread(target=sender_worker, args=(self,), name=f"EventSender-{self.name}",
+                         daemon=True).start()
+        threading.Thread(target=heartbeat_worker, args=(self,), name=f"Heartbeat-{self.name}",
+                         daemon=True).start()
+
+    def event_response(self, enqueued: float, event_data: Dict[str, Any],
+                       error: Optional[Dict[str, Any]]):
+        """Count the response to an event sent over the persistent connection
+
+        Server errors and a connection lost before the response put the
+        event back in the send queue, it is retried after a backoff until
+        its TTL expires.
+        """
+        if error is None:
+            self.stats["sent"] += 1
+            self.retry_backoff = RETRY_BACKOFF_MIN
+            return
+        code = error.get("code") if isinstance(error, dict) else None
+        if not isinstance(code, int) or code < 500:
+            self.stats["failed"] += 1
+            return
+        self.stats["retried"] += 1
+        event_log.log(logging.WARNING, event_data["key"], "Moonraker of %s did not handle %s (%s), retrying in %.1fs",
+                      self.name, event_data["key"], error.get("message"), self.retry_backoff)
+        self.retry_at = time.monotonic() + self.retry_backoff
+        self.retry_backoff = min(self.retry_backoff * 2, RETRY_BACKOFF_MAX)
+        self.send_queue.requeue(enqueued, event_data)
+
+    def should_process_key(self, key_name: str, current_time: float) -> bool:
+        """Check if enough time has passed since the last key press"""
+        last_time = self.last_key_time.get(key_name)
+        debounce_time = get_debounce_time(key_name)
+        time_diff = float("inf") if last_time is None else current_time - last_time
+
+        if time_diff >= debounce_time:
+            self.last_key_time[key_name] = current_time
+            logger.debug("Processing key %s: time since last press = %.1fms", key_name, time_diff * 1000)
+            return True
+
+        logger.debug("Debounced key %s: time since last press = %.1fms < %.1fms",
+                     key_name, time_diff * 1000, debounce_time * 1000)
+        return False
+
+    def get_knob_multiplier(self, key_name: str, current_time: float) -> int:
+        """Record a knob detent and return the step multiplier for its velocity"""
+        detents = self.knob_detent_times[key_name]
+        detents.append(current_time)
+        while detents and current_time - detents[0] > KNOB_VELOCITY_WINDOW:
+            detents.popleft()
+        velocity = len(detents) / KNOB_VELOCITY_WINDOW
+        for min_velocity, multiplier in KNOB_ACCELERATION:
+            if velocity >= min_velocity:
+                return multiplier
+        return 1
+
+# Targets by name, the keyboard backend sends every key to the default one
+targets: Dict[str, Target] = {}
+default_target: Optional[Target] = None
+
+class MoonrakerUnavailable(Exception):
+    """Moonraker could not be reached, the event can be sent again later"""
+
+def send_to_moonraker(target: Target, event_data, enqueued: Optional[float] = None) -> bool:
+    """Send key event data to the target's Moonraker
+
+    Raises MoonrakerUnavailable when the event never reached Moonraker.
+    Over the persistent connection the event is only counted once its
+    response arrives, see Target.event_response.
+    """
+    if target.transport != "http":
+        if enqueued is None:
+            enqueued = time.monotonic()
+        on_response = functools.partial(target.event_response, enqueued, event_data)
+        if not target.conn.call("server.numpad.event", event_data, on_response):
+            raise MoonrakerUnavailable("not connected")
+        event_log.log(logging.INFO, event_data["key"], "Sent event data to %s: %s", target.name, event_data)
+        return True
+    sent = post_to_moonraker(target, event_data)
+    target.stats["sent" if sent else "failed"] += 1
+    return sent
 
-def send_to_moonraker(event_data):
-    """Send key event data to Moonraker with timeout"""
+def post_to_moonraker(target: Target, event_data) -> bool:
+    """Send key event data to Moonraker over HTTP with timeout"""
     try:
-        response = requests.post(
-            f"{MOONRAKER_URL}/server/numpad/event",
+        response = target.session.post(
+            f"{target.moonraker_url}/server/numpad/event",
             json=event_data,
             timeout=REQUEST_TIMEOUT
         )
         response.raise_for_status()
-        logger.info(f"Sent event data to Moonraker: {event_data}")
+        event_log.log(logging.INFO, event_data["key"], "Sent event data to %s: %s", target.name, event_data)
+        return True
+    except requests.ConnectionError as e:
+        # Includes connect timeouts, the request was never received
+        raise MoonrakerUnavailable(str(e)) from e
     except requests.Timeout:
-        logger.warning("Moonraker request timed out - likely busy with macro")
+        logger.warning("Moonraker request to %s timed out - likely busy with macro", target.name)
     except requests.RequestException as e:
-        logger.error(f"Error sending event data to Moonraker: {e}")
+        logger.error("Error sending event data to %s: %s", target.name, e)
+    return False
+
+def call_component(target: Target, method: str, params: Dict[str, Any]) -> bool:
+    """Call a /server/numpad endpoint of the target, True if it was sent"""
+    if target.transport != "http":
+        return target.conn.call(f"server.numpad.{method}", params)
+    try:
+        target.session.post(
+            f"{target.moonraker_url}/server/numpad/{method}",
+            json=params,
+            timeout=REQUEST_TIMEOUT
+        ).raise_for_status()
+        return True
+    except requests.RequestException as e:
+        logger.debug("Call of %s on %s failed: %s", method, target.name, e)
+        return False
+
+def heartbeat_worker(target: Target):
+    """Register with the target's component as soon as it is reachable, then
+    periodically tell it the listener is alive
+
+    The registration tells the component that input is live, along with the
+    startup timing. It is repeated after Moonraker restarts.
+    """
+    registered = None
+    while True:
+        event_log.flush()
+        params = {
+            "pid": os.getpid(),
+            "started": STARTED_AT,
+            "backend": INPUT_BACKEND,
+            "target": target.name,
+            "stats": dict(target.stats)
+        }
+        # The connection count changes when Moonraker restarts, HTTP
+        # registers again after a failed heartbeat
+        connection = target.conn.connections if target.conn is not None else 1
+        if registered != connection:
+            params["startup"] = dict(startup_timing, registered=round(
+                (time.monotonic() - STARTED_MONOTONIC) * 1000, 1))
+            if call_component(target, "register", params):
+                registered = connection
+                logger.info(f"Registered with {target.name} {params['startup']['registered']}ms "
+                            f"after start, {target.stats['queued']} events queued so far")
+                sd_notify(f"STATUS=Registered with {target.name}")
+            elif target.conn is not None and not target.conn.connected.is_set():
+                target.conn.connected.wait(HEARTBEAT_INTERVAL)
+            else:
+                time.sleep(REGISTER_RETRY_INTERVAL)
+            continue
+        if not call_component(target, "heartbeat", params) and target.conn is None:
+            registered = None
+        time.sleep(HEARTBEAT_INTERVAL)
 
 def get_key_name(scan_code: int, original_name: str) -> str:
     """Get mapped key name from scan code or fallback to original with key_ prefix"""
@@ -108,49 +749,197 @@ def get_debounce_time(key_name: str) -> float:
     ms_time = DEBOUNCE_CONFIG.get(key_name, DEBOUNCE_CONFIG['default'])
     return ms_time / 1000.0  # Convert milliseconds to seconds
 
-def should_process_key(key_name: str, current_time: float) -> bool:
-    """Check if enough time has passed since the last key press"""
-    last_time = last_key_time.get(key_name, 0)
-    debounce_time = get_debounce_time(key_name)
-    time_diff = current_time - last_time
-
-    if time_diff >= debounce_time:
-        last_key_time[key_name] = current_time
-        logger.debug(f"Processing key {key_name}: time since last press = {time_diff*1000:.1f}ms")
-        return True
-
-    logger.debug(f"Debounced key {key_name}: time since last press = {time_diff*1000:.1f}ms < {debounce_time*1000:.1f}ms")
-    return False
-
 def on_key_event(e):
-    """Handle key events - only process key down events with debounce"""
+    """Handle key events from the keyboard hook - only key down events are processed"""
     # Only process key down events
     if e.event_type == 'down':
-        current_time = time.time()
-        key_name = get_key_name(e.scan_code, e.name)
+        handle_key_down(e.scan_code, e.name)
 
-        # Check debounce
-        if not should_process_key(key_name, current_time):
-            logger.debug(f"Debounced key event: {key_name}")
-            return
+def handle_key_down(scan_code: int, original_name: str, target: Optional[Target] = None,
+                    current_time: Optional[float] = None) -> str:
+    """Debounce a key down event and queue it for the target's Moonraker
+
+    Runs on the input thread, so it only timestamps and queues the event;
+    network I/O happens on the target's sender thread. The replayer passes
+    the press time, otherwise it is now. Returns the decision: queued,
+    debounced or dropped.
+    """
+    if target is None:
+        target = default_target
+    # Debounce on the monotonic clock, the wall clock time is only sent along
+    if current_time is None:
+        current_time = time.monotonic()
+    key_name = get_key_name(scan_code, original_name)
+
+    # Every detent counts towards the knob velocity, debounced or not
+    multiplier = None
+    if key_name in KNOB_KEYS:
+        multiplier = target.get_knob_multiplier(key_name, current_time)
 
+    # Check debounce
+    if not target.should_process_key(key_name, current_time):
+        logger.debug("Debounced key event: %s", key_name)
+        decision = "debounced"
+    else:
         event_data = {
             "key": key_name,
-            "scan_code": e.scan_code,
-            "event_type": e.event_type,
-            "time": current_time
+            "scan_code": scan_code,
+            "event_type": "down",
+            "time": time.time()
         }
+        if multiplier is not None:
+            event_data["multiplier"] = multiplier
 
-        logger.info(f"Key down event detected: {event_data}")
-        send_to_moonraker(event_data)
+        event_log.log(logging.INFO, key_name, "Key down event detected: %s", event_data)
+        if target.send_queue.put(event_data):
+            decision = "queued"
+        else:
+            decision = "dropped"
+            event_log.log(logging.WARNING, key_name, "Send queue full, dropped event: %s", event_data)
 
-def main():
-    logger.info("Numpad Listener Service started")
-    logger.info(f"Using scan code mapping for {len(SCAN_CODE_MAPPING)} special keys")
-    logger.info("Debounce configuration:")
-    for key, value in DEBOUNCE_CONFIG.items():
-        logger.info(f"- {key}: {value}ms")
+    target.stats[decision] += 1
+    if trace_recorder is not None:
+        trace_recorder.record(current_time, scan_code, original_name, key_name,
+                              target.name, decision, multiplier)
+    return decision
+
+def get_event_ttl(key_name: str) -> Optional[float]:
+    """Get the TTL (in seconds) of a key's events, None never expires"""
+    return EVENT_TTL.get(key_name, EVENT_TTL.get("default"))
 
+def sender_worker(target: Target):
+    """Drain a target's send queue in order, delivering one event at a time"""
+    while True:
+        enqueued, event_data = target.send_queue.get()
+        # Moonraker answered an earlier event with an error, back off
+        delay = target.retry_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        deliver_event(target, enqueued, event_data)
+
+def deliver_event(target: Target, enqueued: float, event_data: Dict[str, Any]):
+    """Send an event, retrying with backoff while Moonraker is unreachable
+
+    The event is discarded once it outlives its TTL, whether it is waiting
+    in the queue or for Moonraker to come back.
+    """
+    key_name = event_data["key"]
+    ttl = get_event_ttl(key_name)
+    backoff = RETRY_BACKOFF_MIN
+    while True:
+        age = time.monotonic() - enqueued
+        if ttl is not None and age > ttl:
+            event_log.log(logging.INFO, key_name,
+                          "Discarded stale event after %.0fms: %s", age * 1000, event_data)
+            target.stats["expired"] += 1
+            return
+        # Lets the component split hook-to-send time from transport time
+        event_data["sent_time"] = time.time()
+        try:
+            send_to_moonraker(target, event_data, enqueued)
+            return
+        except MoonrakerUnavailable as e:
+            target.stats["retried"] += 1
+            event_log.log(logging.WARNING, key_name, "Moonraker of %s unavailable (%s), retrying %s in %.1fs",
+                          target.name, e, key_name, backoff)
+
+        # Wake up in time to expire the event, or as soon as the connection
+        # is back
+        delay = backoff if ttl is None else max(0., min(backoff, ttl - age))
+        if target.conn is not None and not target.conn.connected.is_set():
+            target.conn.connected.wait(delay)
+        else:
+            time.sleep(delay)
+        backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+
+class EvdevInput:
+    """Reads key events from the configured numpad devices with asyncio
+
+    Devices that are missing or get unplugged are reopened as soon as
+    inotify reports changes under /dev/input, instead of polling.
+    """
+
+    def __init__(self, device_targets: Dict[str, Target], grab: bool,
+                 on_ready: Optional[Callable[[], None]] = None):
+        self.device_targets = device_targets
+        self.paths = list(device_targets)
+        self.grab = grab
+        self.on_ready = on_ready
+        self.readers: Dict[str, "asyncio.Task[None]"] = {}
+        self.changed: Optional[asyncio.Event] = None
+        self.inotify = INotify()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+        self._watch_dirs()
+        loop.add_reader(self.inotify.fd, self._handle_inotify)
+        while True:
+            self.changed.clear()
+            for path in self.paths:
+                if path not in self.readers and os.path.exists(path):
+                    self._open(path)
+            # Devices plugged in later are picked up by the inotify watch
+            if self.on_ready is not None:
+                self.on_ready()
+                self.on_ready = None
+            await self.changed.wait()
+
+    def _watch_dirs(self):
+        # The by-id/by-path directories come and go with the devices
+        watch_flags = inotify_flags.CREATE | inotify_flags.ATTRIB | inotify_flags.DELETE
+        for directory in INPUT_WATCH_DIRS:
+            if os.path.isdir(directory):
+                self.inotify.add_watch(directory, watch_flags)
+
+    def _handle_inotify(self):
+        self.inotify.read(timeout=0)
+        self._watch_dirs()
+        self.changed.set()
+
+    def _open(self, path: str):
+        try:
+            device = evdev.InputDevice(path)
+            if self.grab:
+                device.grab()
+        except OSError as e:
+            # Usually udev has not applied permissions yet, the ATTRIB event retries
+            logger.warning(f"Unable to open input device {path}: {e}")
+            return
+        logger.info(f"Listening for key down events on {path} ({device.name}) "
+                    f"for {self.device_targets[path].name}")
+        self.readers[path] = asyncio.ensure_future(self._read(path, device))
+
+    async def _read(self, path: str, device: "evdev.InputDevice"):
+        try:
+            async for event in device.async_read_loop():
+                # Value 1 is a key press and 2 an autorepeat, which the
+                # keyboard backend also reports as 'down'
+                if event.type == evdev.ecodes.EV_KEY and event.value in (1, 2):
+                    handle_key_down(event.code, evdev_key_name(event.code), self.device_targets[path])
+        except OSError as e:
+            logger.warning(f"Lost input device {path}: {e}")
+        finally:
+            self.readers.pop(path, None)
+            try:
+                device.close()
+            except OSError:
+                pass
+            # Give udev a moment before trying the path again
+            asyncio.get_running_loop().call_later(0.5, self.changed.set)
+
+def evdev_key_name(code: int) -> str:
+    """Key name for an evdev code in the keyboard library's style, e.g. KEY_A -> a"""
+    name = evdev.ecodes.KEY.get(code, str(code))
+    if isinstance(name, list):
+        name = name[0]
+    return name.lower().replace("key_", "", 1)
+
+def run_keyboard_backend(on_ready: Optional[Callable[[], None]] = None):
+    global keyboard
+    if len(targets) > 1:
+        raise RuntimeError("Multiple TARGETS require the evdev backend to tell the numpads apart")
+    import keyboard
     while True:
         try:
             # Unhook any existing hooks to prevent duplicate event listeners
@@ -158,6 +947,9 @@ def main():
             
             # Hook the key event handler
             keyboard.hook(on_key_event)
+            if on_ready is not None:
+                on_ready()
+                on_ready = None
 
             logger.info("Listening for key down events...")
             keyboard.wait()
@@ -166,5 +958,124 @@ def main():
             logger.info("Attempting to restart keyboard listener in 5 seconds...")
             time.sleep(5)  # Wait before retrying to prevent rapid error loops
 
+def run_evdev_backend(on_ready: Optional[Callable[[], None]] = None):
+    global asyncio, evdev, INotify, inotify_flags
+    import asyncio
+    try:
+        import evdev
+        from inotify_simple import INotify, flags as inotify_flags
+    except ImportError:
+        raise RuntimeError("The evdev backend requires the evdev and inotify_simple packages")
+    device_targets = {
+        path: target for target in targets.values() for path in target.input_devices
+    }
+    if not device_targets:
+        raise RuntimeError("The evdev backend requires at least one entry in INPUT_DEVICES")
+    asyncio.run(EvdevInput(device_targets, GRAB_DEVICES, on_ready).run())
+
+def is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def check_setting(setting: str, value: Any) -> Optional[str]:
+    """Check the type of a structured config override, returns the problem"""
+    if setting == "TARGETS":
+        if not isinstance(value, dict) or not all(isinstance(v, dict) for v in value.values()):
+            return "an object of target names to objects"
+    elif setting == "INPUT_DEVICES":
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            return "a list of device paths"
+    elif setting == "DEBOUNCE_CONFIG":
+        if not isinstance(value, dict) or not all(is_number(v) for v in value.values()):
+            return "an object of key names to milliseconds"
+    elif setting == "EVENT_TTL":
+        if not isinstance(value, dict) or not all(v is None or is_number(v) for v in value.values()):
+            return "an object of key names to seconds or null"
+    elif setting == "KNOB_ACCELERATION":
+        if not isinstance(value, list) or not all(
+                isinstance(v, list) and len(v) == 2 and all(is_number(n) for n in v) for v in value):
+            return "a list of [detents per second, multiplier] pairs"
+    return None
+
+def load_config():
+    """Override the settings above from the optional JSON config file"""
+    if not os.path.exists(CONFIG_FILE):
+        return
+    with open(CONFIG_FILE) as f:
+        overrides = json.load(f)
+    for name, value in overrides.items():
+        setting = name.upper()
+        if setting not in CONFIGURABLE_SETTINGS:
+            logger.warning(f"Ignoring unknown setting '{name}' in {CONFIG_FILE}")
+            continue
+        problem = check_setting(setting, value)
+        if problem is not None:
+            logger.warning(f"Ignoring setting '{name}' in {CONFIG_FILE}, it must be {problem}")
+            continue
+        globals()[setting] = value
+        logger.info(f"Config override {setting} = {value}")
+
+def build_targets():
+    """Create the printer targets from TARGETS, or the single default one"""
+    global default_target
+    targets.clear()
+    if TARGETS:
+        for name, settings in TARGETS.items():
+            targets[name] = Target(name, settings)
+    else:
+        targets["default"] = Target("default", {"input_devices": INPUT_DEVICES})
+    default_target = next(iter(targets.values()))
+    seen: Dict[str, str] = {}
+    for target in targets.values():
+        for path in target.input_devices:
+            if path in seen:
+                raise RuntimeError(f"Input device {path} is mapped to both {seen[path]} and {target.name}")
+            seen[path] = target.name
+
+def main():
+    log_listener = setup_logging()
+    atexit.register(log_listener.stop)
+    load_config()
+    level = LOG_LEVEL if isinstance(LOG_LEVEL, int) else logging.getLevelName(str(LOG_LEVEL).upper())
+    if not isinstance(level, int):
+        logger.warning(f"Unknown LOG_LEVEL '{LOG_LEVEL}', using INFO")
+        level = logging.INFO
+    logger.setLevel(level)
+    logger.info("Numpad Listener Service started")
+    logger.info(f"Using scan code mapping for {len(SCAN_CODE_MAPPING)} special keys")
+    logger.info("Debounce configuration:")
+    for key, value in DEBOUNCE_CONFIG.items():
+        logger.info(f"- {key}: {value}ms")
+
+    if TRACE_FILE:
+        start_trace(TRACE_FILE)
+
+    # The send queues buffer key events until the transports are up
+    build_targets()
+    if INPUT_BACKEND == "evdev":
+        run_evdev_backend(input_ready)
+    else:
+        run_keyboard_backend(input_ready)
+
+def start_trace(path: str):
+    global trace_recorder
+    trace_recorder = TraceRecorder(path)
+    trace_recorder.start()
+    logger.info(f"Recording key events to {path}")
+
+def input_ready():
+    """Called once the input hook is installed, connects the targets in the
+    background so no key presses are lost while the transport loads"""
+    mark_startup("hook_ready")
+    logger.info(f"Input hook installed {startup_timing['hook_ready']}ms after start")
+    sd_notify("READY=1\nSTATUS=Listening for key events")
+    threading.Thread(target=start_targets, name="TargetStartup", daemon=True).start()
+
+def start_targets():
+    load_transport()
+    for target in targets.values():
+        logger.info(f"Target {target.name}: {target.transport} to {target.moonraker_url}, "
+                    f"devices {target.input_devices or 'all keyboards'}")
+        target.start()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Replay key event traces recorded by numpad_event_service (TRACE_FILE)
+
+Modes:
+- listener: runs the recorded presses through the listener's debounce and
+  knob acceleration (handle_key_down, the path on_key_event and the evdev
+  reader share) and reports where the decisions differ from the recorded
+  ones. With --url the resulting events are delivered to that Moonraker.
+- moonraker: posts the recorded events that were queued straight to
+  /server/numpad/event and counts the component's responses.
+
+Every listener start appends a segment to the trace, the last one is
+replayed unless --segment picks another. --speed scales the recorded
+timing, 2 replays twice as fast. With --max-speed nothing waits between
+presses, the debounce still sees the scaled timing so its decisions are
+reproducible.
+
+Usage:
+    python3 extras/numpad_replay.py TRACE [listener|moonraker] [options]
+"""
+import argparse
+import collections
+import json
+import statistics
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpad_event_service as listener
+
+
+def load_trace(path: str) -> List[Tuple[Dict[str, Any], List[List[Any]]]]:
+    """Read a trace file, returns its segments as (header, records)"""
+    segments: List[Tuple[Dict[str, Any], List[List[Any]]]] = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, dict):
+                if entry.get("trace") != listener.TRACE_VERSION:
+                    raise ValueError(f"{path} is not a version {listener.TRACE_VERSION} numpad trace")
+                segments.append((entry, []))
+            elif segments:
+                segments[-1][1].append(entry)
+            else:
+                raise ValueError(f"{path} does not start with a trace header")
+    if not segments:
+        raise ValueError(f"{path} is empty")
+    return segments
+
+
+def rebase(records: List[List[Any]]) -> List[List[Any]]:
+    """Make the first press of a segment happen at 0ms"""
+    if not records:
+        return records
+    first = records[0][0]
+    return [[record[0] - first] + record[1:] for record in records]
+
+
+def pace(started: float, offset: float, max_speed: bool):
+    """Wait until a press is due, offset in seconds after the replay started"""
+    if not max_speed:
+        delay = started + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def discard_worker(target: "listener.Target"):
+    """Drain a target's send queue when the events are not delivered"""
+    while True:
+        target.send_queue.get()
+
+
+def wait_for_queues(timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and any(t.send_queue.events for t in listener.targets.values()):
+        time.sleep(0.05)
+
+
+def replay_listener(header: Dict[str, Any], records: List[List[Any]], args) -> int:
+    """Replay through the listener, returns the number of changed decisions"""
+    for name, value in header.get("settings", {}).items():
+        setattr(listener, name.upper(), value)
+    if args.config:
+        listener.CONFIG_FILE = args.config
+        listener.load_config()
+    # One HTTP target per recorded target, all delivering to --url
+    listener.TRANSPORT = "http"
+    listener.TARGETS = {
+        name: {"transport": "http", "moonraker_url": args.url}
+        for name in sorted({record[4] for record in records})
+    }
+    listener.build_targets()
+    if args.url:
+        listener.load_transport()
+    for target in listener.targets.values():
+        if args.url:
+            target.connect()
+            worker = listener.sender_worker
+        else:
+            worker = discard_worker
+        threading.Thread(target=worker, args=(target,), daemon=True).start()
+
+    changed = []
+    started = time.monotonic()
+    for offset, scan_code, name, key_name, target_name, recorded, multiplier in records:
+        offset = offset / 1000. / args.speed
+        pace(started, offset, args.max_speed)
+        decision = listener.handle_key_down(
+            scan_code, name, listener.targets[target_name], started + offset
+        )
+        if decision != recorded:
+            changed.append((offset, key_name, recorded, decision))
+    elapsed = time.monotonic() - started
+
+    if args.url:
+        wait_for_queues()
+    print(f"Replayed {len(records)} presses in {elapsed:.2f}s through the listener")
+    for target in listener.targets.values():
+        print(f"  {target.name}: {dict(target.stats)}")
+    for offset, key_name, recorded, decision in changed[:args.show]:
+        print(f"  {offset * 1000:9.1f}ms {key_name}: recorded {recorded}, replayed {decision}")
+    if len(changed) > args.show:
+        print(f"  ... {len(changed) - args.show} more")
+    print(f"{len(changed)} decisions changed")
+    return len(changed)
+
+
+def replay_moonraker(header: Dict[str, Any], records: List[List[Any]], args) -> int:
+    """Post the queued events to the component, returns the number of failures"""
+    listener.load_transport()
+    requests = listener.requests
+    url = args.url or listener.MOONRAKER_URL
+    session = requests.Session()
+    statuses: Dict[str, int] = collections.Counter()
+    latencies: List[float] = []
+
+    started = time.monotonic()
+    for offset, scan_code, name, key_name, target_name, recorded, multiplier in records:
+        if recorded != "queued" or (args.target and target_name != args.target):
+            continue
+        offset = offset / 1000. / args.speed
+        pace(started, offset, args.max_speed)
+        event_data = {
+            "key": key_name,
+            "scan_code": scan_code,
+            "event_type": "down",
+            "time": time.time(),
+            "sent_time": time.time()
+        }
+        if multiplier is not None:
+            event_data["multiplier"] = multiplier
+        sent = time.perf_counter()
+        try:
+            response = session.post(f"{url}/server/numpad/event", json=event_data,
+                                    timeout=args.timeout)
+            response.raise_for_status()
+            statuses[response.json().get("result", {}).get("status", "unknown")] += 1
+        except requests.RequestException as e:
+            statuses["failed"] += 1
+            print(f"  {offset * 1000:9.1f}ms {key_name} failed: {e}")
+        latencies.append((time.perf_counter() - sent) * 1000)
+    elapsed = time.monotonic() - started
+
+    print(f"Posted {len(latencies)} events to {url} in {elapsed:.2f}s")
+    if latencies:
+        print(f"  response_ms: median {statistics.median(latencies):.1f}, max {max(latencies):.1f}")
+    print(f"  statuses: {dict(statuses)}")
+    return statuses["failed"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", help="Trace file written by the listener's TRACE_FILE")
+    parser.add_argument("mode", nargs="?", default="listener", choices=("listener", "moonraker"))
+    parser.add_argument("--segment", type=int, default=-1,
+                        help="Segment (listener start) to replay, negative counts from the end")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Timing scale, 2 replays twice as fast")
+    parser.add_argument("--max-speed", action="store_true",
+                        help="Do not wait between presses")
+    parser.add_argument("--url", default=None,
+                        help="Moonraker to deliver to, listener mode only delivers when set")
+    parser.add_argument("--config", default=None,
+                        help="Listener JSON config applied over the recorded settings")
+    parser.add_argument("--target", default=None,
+                        help="moonraker mode, only replay this target's events")
+    parser.add_argument("--timeout", type=float, default=5.0,
+                        help="moonraker mode, seconds to wait for each response")
+    parser.add_argument("--show", type=int, default=20,
+                        help="listener mode, changed decisions to list")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be above 0")
+
+    segments = load_trace(args.trace)
+    try:
+        header, records = segments[args.segment]
+    except IndexError:
+        parser.error(f"--segment out of range, the trace has {len(segments)} segments")
+    records = rebase(records)
+    print(f"Segment {args.segment % len(segments) + 1} of {len(segments)}: {len(records)} presses, "
+          f"{header.get('backend')} backend, recorded {time.ctime(header.get('started', 0))}")
+    if args.mode == "moonraker":
+        failures = replay_moonraker(header, records, args)
+    else:
+        failures = replay_listener(header, records, args)
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
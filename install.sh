@@ -41,6 +41,12 @@ log_warning() {
     echo -e "${YELLOW}$(date): $1${NC}" | tee -a "$INSTALL_LOG"
 }
 
+# input_mode: direct reads the numpad in Moonraker, the listener service
+# must not run alongside it or every key press is handled twice
+direct_input_mode() {
+    grep -qE "^input_mode:[[:space:]]*direct" "$MOONRAKER_CONF"
+}
+
 # Check if running as root
 check_root() {
     if [ "$EUID" -ne 0 ]; then
@@ -102,7 +108,8 @@ After=network.target moonraker.service
 Wants=moonraker.service
 
 [Service]
-Type=simple
+Type=notify
+NotifyAccess=main
 User=root
 ExecStart=/usr/bin/python3 ${REPO_DIR}/extras/numpad_event_service.py
 Restart=always
@@ -114,7 +121,12 @@ WantedBy=multi-user.target
 EOL
     # Reload systemd and enable service
     systemctl daemon-reload
-    systemctl enable numpad_event_service.service
+    if direct_input_mode; then
+        log_warning "input_mode is direct, stopping and disabling numpad_event_service"
+        systemctl disable --now numpad_event_service.service
+    else
+        systemctl enable numpad_event_service.service
+    fi
 }
 
 # Setup Moonraker component symlink
@@ -145,7 +157,9 @@ update_moonraker_conf() {
 # Restart services
 restart_services() {
     log_message "Restarting services..."
-    systemctl restart numpad_event_service
+    if ! direct_input_mode; then
+        systemctl restart numpad_event_service
+    fi
     systemctl restart moonraker
 }
 